@@ -1,114 +1,100 @@
-from typing import List, Dict, Tuple
+from typing import List, Tuple
 import sys
 from geopy.distance import geodesic
-from tools import Stop, Route, format_time, time_to_minutes, Algorithm, change_minutes
-from dataclasses import dataclass
-
-@dataclass
-class StopRecord():
-    f: int
-    g: int
-    last_stop: Stop
-    last_route: Route
+import numpy as np
+from tools import Stop, Route, Frontier, Labels, time_to_minutes, haversine_km, Algorithm
+from landmarks import Landmarks
+from dijkstra import print_itinerary
 
 class AStar(Algorithm):
-    def __init__(self, filename="connection_graph (1).csv") -> None:
-        super().__init__(filename)
-    
+    def __init__(self, graph="connection_graph (1).csv", exact: bool = False, landmarks: int = 16) -> None:
+        # landmarks tighten the haversine table with ALT lower bounds, built in _create, 0 leaves them out
+        self.landmark_count = landmarks
+        # the ride times of the landmark tables change with the timetable
+        self.indexes_times = landmarks > 0
+        super().__init__(graph)
+        # exact computes geodesic distances on every relaxation instead of the haversine table
+        self.exact = exact
+
     def _create(self):
-        self.graph: Dict[Stop, Dict[Stop, List[Route]]] = {}
-        for stop in self.data.itertuples():
-            start_stop: Stop = Stop(stop.start_stop, stop.start_stop_lat, stop.start_stop_lon) 
-            end_stop: Stop = Stop(stop.end_stop, stop.end_stop_lat, stop.end_stop_lon)
-            route: Route = Route(line=stop.line, departure_minutes=time_to_minutes(stop.departure_time), arrival_minutes=time_to_minutes(stop.arrival_time))
-            if start_stop not in self.graph.keys():
-                self.graph[start_stop] = {end_stop: [route]}
-            elif end_stop in self.graph[start_stop].keys():
-             self.graph[start_stop][end_stop].append(route)
-            else:
-                self.graph[start_stop][end_stop] = [route] 
-            if end_stop not in self.graph.keys():
-                self.graph[end_stop] = {}
-        for stop, neighbors in self.graph.items():
-            for _, routes in neighbors.items():
-                routes.sort(key=lambda rt: rt.arrival_minutes)   
+        # labels of the stops, reused by every query
+        self.labels = Labels(len(self.graph.stops), f=1e10, g=1e10, last_stop=None, last_route=None)
+        self.landmarks = Landmarks(self.graph, self.landmark_count) if self.landmark_count > 0 else None
     
     def euclidean(next_node: Stop, end_node: Stop) -> float:
         # distance in kilometers / 60 as optimistic velocity in km/h = optimistic time in hours
         # optimistic time in hours * 60 as minutes in an hour = optimistic time in minutes
         return 60 * geodesic((next_node.latitude,next_node.longitude), (end_node.latitude,end_node.longitude)).kilometers / 120
+
+    def euclidean_table(self, end_node: Stop) -> List[float]:
+        # the same estimate for every stop at once
+        return (60 * haversine_km(self.graph.latitudes, self.graph.longitudes, end_node.latitude, end_node.longitude) / 120).tolist()
     
     def _proceed(self, a_start: Stop, b_end:Stop, start_time: str):
         time = time_to_minutes(start_time)
-        self.stops_records: Dict[Stop, StopRecord] = {} 
-        for key in self.graph.keys():
-            self.stops_records[key] = StopRecord(1e10, 1e10, None, None)
-        self.stops_records[a_start] = StopRecord(time, time, None, None)
-        unseen_stops = list(self.graph.keys())
-        seen_stops = []
-        while(len(unseen_stops) > 0):
-            curr_stop = unseen_stops[0]
-            for stop in unseen_stops:
-                if self.stops_records[stop].f < self.stops_records[curr_stop].f:
-                    curr_stop = stop
-            if curr_stop == b_end:
+        graph = self.graph
+        labels = self.labels
+        labels.reset()
+        fs, gs, last_stops, last_routes = labels.f, labels.g, labels.last_stop, labels.last_route
+        start = graph.stop_ids[a_start]
+        end = graph.stop_ids[b_end]
+        labels.touch(start)
+        fs[start], gs[start] = time, time
+        # distances are measured to the target as stored in the graph
+        target = graph.stops[end]
+        with self._phase("heuristic"):
+            heuristic = None if self.exact else self.euclidean_table(target)
+            if heuristic is not None and self.landmarks is not None:
+                heuristic = np.maximum(heuristic, self.landmarks.lower_bounds(end)).tolist()
+        frontier = Frontier()
+        # stop ids break ties between stops with the same f
+        frontier.push(start, time, start)
+        stats = self.stats
+        while(len(frontier) > 0):
+            if stats is not None:
+                stats.frontier(len(frontier.heap))
+            curr_stop = frontier.pop()
+            if curr_stop == end:
                 return
-            unseen_stops.remove(curr_stop)
-            seen_stops.append(curr_stop)
-            # normalize arrival time to 24h
-            g_partial = self.stops_records[curr_stop].g % (24*60) 
-            for neighbor, routes in self.graph[curr_stop].items():             
-                min_arrival_id = -1
-                for i in range(len(routes)):
-                    # take time for a change of line
-                    change_fine = 0 if self.stops_records[curr_stop].last_route is not None and routes[i].line == self.stops_records[curr_stop].last_route.line else change_minutes
-                    if g_partial + change_fine <= routes[i].departure_minutes:
-                        min_arrival_id = i
-                        break
-                # if there are no more this day, take the first one after midnight...
-                g = routes[min_arrival_id].arrival_minutes if min_arrival_id > -1 else 24*60+routes[0].arrival_minutes
-                # ...therefore, this is the chosen route id
-                min_arrival_id = max(min_arrival_id,0)
-                # derive real cost including days already travelled (anti-prior-normalization)
-                g += (self.stops_records[curr_stop].g // (24*60)) * 24*60
-                # derive real cost adding day if you were on a road during midnight
-                g += 0 if routes[min_arrival_id].arrival_minutes >= routes[min_arrival_id].departure_minutes else 24*60
-                
-                if neighbor not in unseen_stops and neighbor not in seen_stops:
-                    unseen_stops.append(neighbor)
-                    self.stops_records[neighbor].g = g
-                    self.stops_records[neighbor].f = g + AStar.euclidean(neighbor, b_end)
-                    self.stops_records[neighbor].last_stop = curr_stop
-                    self.stops_records[neighbor].last_route = routes[min_arrival_id]
-                else:
-                    if g < self.stops_records[neighbor].g:
-                        self.stops_records[neighbor].g = g
-                        self.stops_records[neighbor].f = g + AStar.euclidean(neighbor, b_end)
-                        self.stops_records[neighbor].last_stop = curr_stop
-                        self.stops_records[neighbor].last_route = routes[min_arrival_id]
-                        if neighbor in seen_stops:
-                            unseen_stops.append(neighbor)
-                            seen_stops.remove(neighbor)
+            if stats is not None:
+                stats.settled += 1
+                stats.relaxed += int(graph.edge_offsets[curr_stop+1] - graph.edge_offsets[curr_stop])
+            curr_g = gs[curr_stop]
+            last_line = graph.conn_lines[last_routes[curr_stop]] if last_routes[curr_stop] is not None else None
+            for edge in range(graph.edge_offsets[curr_stop], graph.edge_offsets[curr_stop+1]):
+                neighbor = int(graph.edge_targets[edge])
+                g, conn = graph.arrival_after(edge, curr_g, last_line)
+                labels.touch(neighbor)
+                if g < gs[neighbor]:
+                    gs[neighbor] = g
+                    if stats is not None:
+                        stats.heuristic_evaluations += 1
+                    fs[neighbor] = g + (AStar.euclidean(graph.stops[neighbor], target) if heuristic is None else heuristic[neighbor])
+                    last_stops[neighbor] = curr_stop
+                    last_routes[neighbor] = conn
+                    # reopens the neighbor if it has already been expanded
+                    frontier.push(neighbor, fs[neighbor], neighbor)
                     
     def _print(self, a_start: Stop, b_end: Stop, start_time: str) -> None:
-        temp = b_end, self.stops_records[b_end]
-        route: List[Tuple[Stop, StopRecord]] = []
-        max_length = [0,0,0,0,0]
-        while temp[1].last_stop is not None:
-            route.append(temp)
-            for i, element in enumerate([temp[1].last_route.line, temp[1].last_stop.name, format_time(temp[1].last_route.departure_minutes), temp[0].name, format_time(temp[1].last_route.arrival_minutes)]):
-                max_length[i] = len(str(element)) if len(str(element)) > max_length[i] else max_length[i]
-            temp = temp[1].last_stop, self.stops_records[temp[1].last_stop]
+        graph = self.graph
+        labels = self.labels
+        end = graph.stop_ids[b_end]
+        labels.touch(end)
+        stop = end
+        route: List[Tuple[Stop, Route, Stop, float]] = []
+        while labels.last_stop[stop] is not None:
+            route.append((graph.stops[labels.last_stop[stop]], graph.route(labels.last_route[stop]), graph.stops[stop], labels.f[stop]))
+            stop = labels.last_stop[stop]
         route.reverse()
         print(f"From {a_start.name} at {start_time}:")
-        for i, stop in enumerate(route):
-            day_info = "Day " +  str(stop[1].f // (24*60) + 1)
-            print(f"{str(i+1).rjust(len(str(len(route))))}. \t{str(stop[1].last_route.line).rjust(max_length[0])}) [{format_time(stop[1].last_route.departure_minutes).rjust(max_length[2])}] {stop[1].last_stop.name.ljust(max_length[1])} - "
-                f"[{format_time(stop[1].last_route.arrival_minutes)}] {stop[0].name} ({day_info})")
+        print_itinerary(route)
         print(f'Cost function: {self._cost(a_start, b_end, start_time)}', file=sys.stderr)
 
     def _cost(self, a_start: Stop, b_end: Stop, start_time: str) -> int:
-        return self.stops_records[b_end].g - time_to_minutes(start_time)
+        # None when the stop cannot be reached
+        end = self.graph.stop_ids[b_end]
+        self.labels.touch(end)
+        return self.labels.g[end] - time_to_minutes(start_time) if self.labels.g[end] < 1e10 else None
 
 def run(a_start: Stop, b_end: Stop, start_time: str) -> None:
     a = AStar()
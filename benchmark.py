@@ -0,0 +1,99 @@
+from typing import List, Dict, Tuple, Callable
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time as tm
+import tracemalloc
+import numpy as np
+from tools import Stop, format_time
+from timetable import Timetable
+from dijkstra import Dijkstra
+from a_star import AStar
+from a_star_changes import AStarChanges
+from csa import ConnectionScan
+from raptor import Raptor
+import generator
+
+# engines by the criteria of Solution.find
+engines = {'d': Dijkstra, 't': AStar, 'p': AStarChanges, 'c': ConnectionScan, 'r': Raptor}
+
+def measure(build: Callable[[], object]) -> Tuple[object, Dict[str, float]]:
+    # wall time and peak of the python allocations (numpy included) while building
+    tracemalloc.start()
+    begin = tm.perf_counter()
+    result = build()
+    seconds = tm.perf_counter() - begin
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'seconds': seconds, 'peak_bytes': peak}
+
+def latencies(engine, queries: List[Tuple[str, str, str]]) -> Dict[str, float]:
+    samples = []
+    # queries without a result (an unreachable end), left out of the percentiles
+    failed: List[Tuple[str, str, str]] = []
+    for a_start, b_end, start_time in queries:
+        begin = tm.perf_counter()
+        cost, _ = engine.run(Stop(a_start,0,0), Stop(b_end,0,0), start_time, debug=False)
+        seconds = tm.perf_counter() - begin
+        if cost is None:
+            failed.append((a_start, b_end, start_time))
+        else:
+            samples.append(seconds)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]).tolist() if samples else (None, None, None)
+    return {'queries': len(samples), 'failures': len(failed), 'failed': failed, 'mean': float(np.mean(samples)) if samples else None,
+            'p50': p50, 'p95': p95, 'p99': p99}
+
+def bench_timetable(filename: str, criteria: str, n_queries: int, seed: int, landmarks: int = 16) -> Dict[str, object]:
+    graph, build = measure(lambda: Timetable.from_csv([filename]))
+    result = {'stops': len(graph.stops), 'edges': len(graph.edge_targets), 'connections': len(graph.departures),
+              'build': build, 'ingestion': graph.ingestion, 'engines': {}}
+    # the same queries for every engine
+    rng = random.Random(seed)
+    names = [stop.name for stop in graph.stops]
+    queries = [(*rng.sample(names, 2), format_time(rng.randrange(24*60)) + ':00') for _ in range(n_queries)]
+    for c in criteria:
+        engine, create = measure(lambda: engines[c](graph, landmarks=landmarks) if engines[c] is AStar else engines[c](graph))
+        result['engines'][c] = {'engine': engines[c].__name__, 'create': create, 'latency': latencies(engine, queries)}
+        if getattr(engine, 'landmarks', None) is not None:
+            result['engines'][c]['landmarks'] = engine.landmarks.report()
+    return result
+
+def run(sizes: List[Tuple[int, int]], criteria: str = 'dtpcr', n_queries: int = 200, seed: int = 0,
+        midnight: bool = True, landmarks: int = 16) -> Dict[str, object]:
+    # one synthetic timetable per (stops, lines) size, generated in a temporary directory
+    report = {'python': platform.python_version(), 'platform': platform.platform(), 'seed': seed, 'landmarks': landmarks, 'timetables': []}
+    with tempfile.TemporaryDirectory() as directory:
+        for n_stops, n_lines in sizes:
+            filename = os.path.join(directory, f"synthetic_{n_stops}_{n_lines}.csv")
+            data = generator.generate(n_stops, n_lines, last_departure=(25 if midnight else 23)*60, seed=seed)
+            generator.write(data, filename)
+            print(f"{n_stops} stops, {n_lines} lines: {len(data)} connections", file=sys.stderr)
+            result = {'n_stops': n_stops, 'n_lines': n_lines}
+            result.update(bench_timetable(filename, criteria, n_queries, seed, landmarks))
+            report['timetables'].append(result)
+    return report
+
+def parse_size(size: str) -> Tuple[int, int]:
+    n_stops, n_lines = size.split('x')
+    return int(n_stops), int(n_lines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build time, memory and query latency of the engines on synthetic timetables")
+    parser.add_argument('sizes', nargs='*', type=parse_size, default=[(100, 20), (300, 60), (900, 200)], help="STOPSxLINES")
+    parser.add_argument('--criteria', default='dtpcr')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-midnight', dest='midnight', action='store_false', help="no trips after midnight")
+    parser.add_argument('--landmarks', type=int, default=16, help="ALT landmarks of A*, 0 for the haversine bound alone")
+    parser.add_argument('--output', help="json file, stdout by default")
+    args = parser.parse_args()
+    report = run(args.sizes, args.criteria, args.queries, args.seed, args.midnight, args.landmarks)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
@@ -0,0 +1,247 @@
+from typing import List, Dict, Tuple
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+from tools import Stop, format_time
+from timetable import Timetable, parse_times, tombstone
+from dijkstra import Dijkstra
+from a_star import AStar
+from a_star_changes import AStarChanges
+from csa import ConnectionScan
+from raptor import Raptor
+import generator
+
+# reruns the equivalence checks behind the streaming ingestion, the timetable updates, the ALT heuristic and the pruned Dijkstra
+# on a synthetic timetable; prints a json report and exits with 1 on any mismatch
+
+def read_frame(filename: str) -> pd.DataFrame:
+    data = pd.read_csv(filename, low_memory=False)
+    data.set_index(keys='Unnamed: 0', inplace=True)
+    data.drop_duplicates(ignore_index=True, inplace=True)
+    return data
+
+def frame_timetable(data: pd.DataFrame) -> Timetable:
+    # the timetable of a whole frame at once, as it was built before the streaming ingestion
+    start_names = data['start_stop'].to_numpy()
+    end_names = data['end_stop'].to_numpy()
+    # interleave start and end stops, so the numbering follows the order of the rows
+    names = pd.Series(np.column_stack([start_names, end_names]).ravel())
+    latitudes = pd.Series(np.column_stack([data['start_stop_lat'].to_numpy(), data['end_stop_lat'].to_numpy()]).ravel())
+    longitudes = pd.Series(np.column_stack([data['start_stop_lon'].to_numpy(), data['end_stop_lon'].to_numpy()]).ravel())
+    stop_codes, stop_names = pd.factorize(names)
+    first = ~pd.Series(stop_codes).duplicated().to_numpy()
+    stop_latitudes = latitudes.to_numpy(dtype=np.float64)[first]
+    stop_longitudes = longitudes.to_numpy(dtype=np.float64)[first]
+    stops = [Stop(name, lat, lon) for name, lat, lon in zip(stop_names, stop_latitudes, stop_longitudes)]
+    start = stop_codes[0::2].astype(np.int64)
+    end = stop_codes[1::2].astype(np.int64)
+
+    line_codes, lines = pd.factorize(data['line'])
+    departures = parse_times(data['departure_time'])
+    arrivals = parse_times(data['arrival_time'])
+    arrays = Timetable.build_arrays(len(stops), start, end, line_codes, departures, arrivals)
+    arrays['latitudes'] = stop_latitudes
+    arrays['longitudes'] = stop_longitudes
+    return Timetable(stops, list(lines), arrays)
+
+def check_ingestion(filename: str, chunk_size: int) -> Dict[str, object]:
+    # the csv streamed in small chunks against the whole frame read at once, the timetables must be the same
+    streamed, expected = Timetable.from_csv([filename], chunk_size), frame_timetable(read_frame(filename))
+    report = {'chunk_size': chunk_size, 'same_stops': [stop.name for stop in streamed.stops] == [stop.name for stop in expected.stops],
+              'same_lines': [str(line) for line in streamed.lines] == [str(line) for line in expected.lines],
+              'different_arrays': [name for name in Timetable.array_names if not np.array_equal(getattr(streamed, name), getattr(expected, name))]}
+    report['ok'] = report['same_stops'] and report['same_lines'] and not report['different_arrays']
+    return report
+
+def layout_errors(graph: Timetable) -> List[str]:
+    # the invariants the lookups rely on: connections of every edge sorted by (departure, arrival), removed ones last,
+    # line groups pointing into their own edge, sorted by position and mirroring the departures
+    errors = []
+    for edge in range(len(graph.edge_targets)):
+        first, last = graph.conn_offsets[edge], graph.conn_offsets[edge+1]
+        keys = graph.departures[first:last].astype(np.int64) * 2**16 + graph.arrivals[first:last]
+        if np.any(np.diff(keys) < 0):
+            errors.append(f"edge {edge} is not sorted")
+        for group in range(graph.group_offsets[edge], graph.group_offsets[edge+1]):
+            conns = graph.group_conns[graph.group_conn_offsets[group]:graph.group_conn_offsets[group+1]]
+            if np.any(conns < first) or np.any(conns >= last) or np.any(np.diff(conns) <= 0):
+                errors.append(f"group {group} points outside edge {edge} or is not sorted")
+            elif np.any(graph.conn_lines[conns] != graph.group_lines[group]) or np.any(graph.group_departures[graph.group_conn_offsets[group]:graph.group_conn_offsets[group+1]] != graph.departures[conns]):
+                errors.append(f"group {group} does not match its connections")
+            elif np.any(ride_ends(graph, graph.group_arrival_conns[graph.group_conn_offsets[group]:graph.group_conn_offsets[group+1]]) != first_ends(graph, conns)):
+                errors.append(f"group {group} does not point to its first arrivals")
+        conns = np.arange(first, last)
+        if np.any(ride_ends(graph, graph.arrival_conns[first:last]) != first_ends(graph, conns)):
+            errors.append(f"edge {edge} does not point to its first arrivals")
+    if sum(np.diff(graph.group_conn_offsets)) != len(graph.departures):
+        errors.append("the groups do not cover every connection")
+    return errors
+
+def ride_ends(graph: Timetable, conns: np.ndarray) -> np.ndarray:
+    # arrivals from the midnight before the departure, removed connections last
+    departures, arrivals = graph.departures[conns].astype(np.int64), graph.arrivals[conns].astype(np.int64)
+    return np.where(departures == tombstone, 3*24*60, arrivals + np.where(arrivals < departures, 24*60, 0))
+
+def first_ends(graph: Timetable, conns: np.ndarray) -> np.ndarray:
+    # the first arrival of the connections from every one of them on, as the lookups should board
+    ends = ride_ends(graph, conns)
+    return np.minimum.accumulate(ends[::-1])[::-1]
+
+def live_connections(graph: Timetable) -> List[Tuple[str, str, object, int, int]]:
+    # every connection not removed, by names and minutes
+    sources, targets = graph.connection_stops()
+    return sorted((graph.stops[source].name, graph.stops[target].name, str(graph.lines[line]), int(departure), int(arrival))
+                  for source, target, line, departure, arrival in zip(sources.tolist(), targets.tolist(), graph.conn_lines.tolist(),
+                                                                     graph.departures.tolist(), graph.arrivals.tolist())
+                  if departure != tombstone)
+
+def costs(engines: Dict[str, object], queries: List[Tuple[str, str, str]]) -> Dict[str, List[object]]:
+    results = {}
+    for name, engine in engines.items():
+        results[name] = []
+        for a_start, b_end, start_time in queries:
+            # None for an unreachable end, in every engine
+            results[name].append(engine.run(Stop(a_start,0,0), Stop(b_end,0,0), start_time, debug=False)[0])
+    return results
+
+def mismatches(expected: List[object], found: List[object], queries: List[Tuple[str, str, str]]) -> List[Tuple[Tuple[str, str, str], object, object]]:
+    return [(query, a, b) for query, a, b in zip(queries, expected, found) if a != b]
+
+def all_engines(graph: Timetable) -> Dict[str, object]:
+    return {'d': Dijkstra(graph), 't': AStar(graph), 'p': AStarChanges(graph), 'c': ConnectionScan(graph), 'r': Raptor(graph)}
+
+def check_updates(filename: str, directory: str, queries: List[Tuple[str, str, str]], n_updates: int, seed: int) -> Dict[str, object]:
+    # updates applied in place against the same edits made to the csv and built from scratch
+    rng = random.Random(seed)
+    graph = Timetable.load(filename, cache=False)
+    engines = all_engines(graph)
+    # every engine has built its index before the updates, so the refresh is checked as well
+    costs(engines, queries[:5])
+    data = read_frame(filename)
+    key = data['line'].astype(str) + '|' + data['start_stop'] + '|' + data['end_stop'] + '|' + data['departure_time']
+    rows = data[~key.duplicated(keep=False)].sample(n_updates, random_state=seed)
+    # loading drops repeated rows, so the edits never make a connection the same as another one
+    taken = set(zip(data['line'].astype(str), data['start_stop'], data['end_stop'],
+                    data['departure_time'].map(time_minutes), data['arrival_time'].map(time_minutes)))
+    removed = []
+    with graph.batch():
+        for i, (index, row) in enumerate(rows.iterrows()):
+            departure, arrival = time_minutes(row['departure_time']), time_minutes(row['arrival_time'])
+            minutes = rng.randrange(-30, 60)
+            shifted = (str(row['line']), row['start_stop'], row['end_stop'], (departure + minutes) % (24*60), (arrival + minutes) % (24*60))
+            if i % 5 == 0 or shifted in taken:
+                graph.remove_connection(row['line'], row['start_stop'], row['end_stop'], row['departure_time'])
+                removed.append(index)
+            else:
+                graph.shift_connection(row['line'], row['start_stop'], row['end_stop'], row['departure_time'], minutes)
+                data.loc[index, 'departure_time'], data.loc[index, 'arrival_time'] = format_time(shifted[3]) + ':00', format_time(shifted[4]) + ':00'
+                taken.add(shifted)
+    shifted = compare(graph, engines, data.drop(index=removed), os.path.join(directory, 'shifted.csv'), queries)
+    slots = len(removed) // 2
+    structural = {'line': 10**6, 'stop': "Nowy przystanek"}
+    added = []
+    with graph.batch():
+        # into the places of removed connections
+        for index in removed[:slots]:
+            row = rows.loc[index]
+            departure = rng.randrange(24*60)
+            # the same trip must not be there already
+            while (str(row['line']), row['start_stop'], row['end_stop'], departure, (departure + 3) % (24*60)) in taken:
+                departure = rng.randrange(24*60)
+            taken.add((str(row['line']), row['start_stop'], row['end_stop'], departure, (departure + 3) % (24*60)))
+            added.append((row['line'], row['start_stop'], row['end_stop'], departure, (departure + 3) % (24*60), row))
+            graph.add_connection(*added[-1][:5])
+    # the batches so far stayed in place, before the structural ones rebuild and sort everything again
+    reused = {'slots_reused': graph.tombstones == len(removed) - slots, 'tombstones': graph.tombstones,
+              **compare(graph, engines, with_rows(data.drop(index=removed), added), os.path.join(directory, 'reused.csv'), queries)}
+    # a new line between existing stops, and a new stop
+    base = rows.loc[removed[slots]] if slots < len(removed) else rows.iloc[0]
+    latitude, longitude = base['end_stop_lat'] + 0.003, base['end_stop_lon'] + 0.003
+    for start, end, departure in ((base['start_stop'], base['end_stop'], 8*60), (base['end_stop'], structural['stop'], 8*60 + 10),
+                                  (structural['stop'], base['end_stop'], 8*60 + 20)):
+        graph.add_connection(structural['line'], start, end, departure, departure + 3, end_location=(latitude, longitude))
+        row = base.copy()
+        row['start_stop'], row['end_stop'] = start, end
+        if start == structural['stop']:
+            row['start_stop_lat'], row['start_stop_lon'] = latitude, longitude
+            row['end_stop_lat'], row['end_stop_lon'] = base['end_stop_lat'], base['end_stop_lon']
+        if end == structural['stop']:
+            row['start_stop_lat'], row['start_stop_lon'] = base['end_stop_lat'], base['end_stop_lon']
+            row['end_stop_lat'], row['end_stop_lon'] = latitude, longitude
+        added.append((structural['line'], start, end, departure, departure + 3, row))
+    queries = queries + [(queries[0][0], structural['stop'], '7:55:00')]
+    rebuilt = {'stops': len(graph.stops), 'tombstones': graph.tombstones,
+               **compare(graph, engines, with_rows(data.drop(index=removed), added), os.path.join(directory, 'rebuilt.csv'), queries)}
+    report = {'updates': n_updates, 'removed': len(removed), 'shifted': shifted, 'reused': reused, 'rebuilt': rebuilt}
+    report['ok'] = shifted['ok'] and reused['slots_reused'] and reused['ok'] and rebuilt['ok']
+    return report
+
+def with_rows(data: pd.DataFrame, added: List[Tuple[object, str, str, int, int, pd.Series]]) -> pd.DataFrame:
+    rows = []
+    for line, start, end, departure, arrival, row in added:
+        row = row.copy()
+        row['line'], row['departure_time'], row['arrival_time'] = line, format_time(departure) + ':00', format_time(arrival) + ':00'
+        rows.append(row)
+    return pd.concat([data, pd.DataFrame(rows)], ignore_index=True)
+
+def compare(graph: Timetable, engines: Dict[str, object], data: pd.DataFrame, filename: str, queries: List[Tuple[str, str, str]]) -> Dict[str, object]:
+    # the updated graph against one built from scratch out of the same rows
+    data.to_csv(filename, index=False)
+    fresh = Timetable.load(filename, cache=False)
+    found, expected = costs(engines, queries), costs(all_engines(fresh), queries)
+    report = {'layout_errors': layout_errors(graph), 'same_connections': live_connections(graph) == live_connections(fresh),
+              'mismatches': {name: mismatches(expected[name], found[name], queries) for name in engines}}
+    report['ok'] = not report['layout_errors'] and report['same_connections'] and not any(report['mismatches'].values())
+    return report
+
+def time_minutes(time: str) -> int:
+    hours, minutes = time.split(':')[:2]
+    return (int(hours) * 60 + int(minutes)) % (24*60)
+
+def check_landmarks(graph: Timetable, queries: List[Tuple[str, str, str]]) -> Dict[str, object]:
+    # A* with the ALT bounds against the haversine bound alone, the costs must be the same
+    results = costs({'haversine': AStar(graph, landmarks=0), 'alt': AStar(graph, landmarks=16)}, queries)
+    report = {'mismatches': mismatches(results['haversine'], results['alt'], queries)}
+    report['ok'] = not report['mismatches']
+    return report
+
+def check_dijkstra(graph: Timetable, queries: List[Tuple[str, str, str]]) -> Dict[str, object]:
+    # target-pruned and bidirectional Dijkstra against the search settling every stop,
+    # and all of them against Connection Scan, which boards the first arrival of every edge by construction
+    results = costs({'full': Dijkstra(graph, target_pruning=False), 'pruned': Dijkstra(graph),
+                     'bidirectional': Dijkstra(graph, bidirectional=True), 'connection_scan': ConnectionScan(graph)}, queries)
+    report = {name: mismatches(results['full'], results[name], queries) for name in ('pruned', 'bidirectional', 'connection_scan')}
+    report['ok'] = not any(report.values())
+    return report
+
+def run(n_stops: int = 200, n_lines: int = 40, n_queries: int = 100, n_updates: int = 500, seed: int = 0) -> Dict[str, object]:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'synthetic.csv')
+        generator.write(generator.generate(n_stops, n_lines, seed=seed), filename)
+        graph = Timetable.load(filename, cache=False)
+        names = [stop.name for stop in graph.stops]
+        queries = [(*rng.sample(names, 2), format_time(rng.randrange(24*60)) + ':00') for _ in range(n_queries)]
+        report = {'seed': seed, 'stops': len(graph.stops), 'connections': len(graph.departures), 'queries': n_queries,
+                  'ingestion': check_ingestion(filename, max(len(graph.departures) // 7, 1)),
+                  'landmarks': check_landmarks(graph, queries), 'dijkstra': check_dijkstra(graph, queries),
+                  'updates': check_updates(filename, directory, queries, n_updates, seed)}
+    report['ok'] = all(report[name]['ok'] for name in ('ingestion', 'landmarks', 'dijkstra', 'updates'))
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the streaming ingestion, the pruned searches and the timetable updates against their plain counterparts")
+    parser.add_argument('--stops', type=int, default=200)
+    parser.add_argument('--lines', type=int, default=40)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--updates', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    report = run(args.stops, args.lines, args.queries, args.updates, args.seed)
+    json.dump(report, sys.stdout, indent=2, default=str)
+    sys.exit(0 if report['ok'] else 1)
@@ -0,0 +1,117 @@
+from bisect import bisect_left
+import numpy as np
+from tools import Stop, Labels, time_to_minutes, change_minutes
+from timetable import day_minutes, tombstone
+from dijkstra import Dijkstra
+
+# connections are checked against the labels in numpy chunks of this size before the python loop
+chunk_size = 2048
+
+class ConnectionScan(Dijkstra):
+    # earliest arrival by scanning all the connections in order of departure,
+    # the labels and the output are the same as in Dijkstra
+    indexes_times = True
+
+    def __init__(self, graph="connection_graph (1).csv") -> None:
+        super().__init__(graph)
+
+    def _create(self):
+        graph = self.graph
+        sources, targets = graph.connection_stops()
+        # every connection of the graph once, sorted by departure
+        self.conns = np.argsort(graph.departures, kind='stable').astype(np.int32)
+        # without the removed ones
+        self.conns = self.conns[graph.departures[self.conns] != tombstone]
+        self.scan_departures = graph.departures[self.conns]
+        self.scan_arrivals = graph.arrivals[self.conns]
+        self.scan_sources = sources[self.conns]
+        self.scan_targets = targets[self.conns]
+        self.scan_lines = graph.conn_lines[self.conns]
+        # the labels of Dijkstra plus the line a stop is reached by,
+        # and the arrivals once more in an array for the numpy checks, kept up to date with the labels
+        self.labels = Labels(len(graph.stops), min_arrival_minutes=1e10, last_stop=None, last_route=None, last_line=None)
+        self.scan_labels = np.full(len(graph.stops), 1e10)
+
+    def _proceed(self, a_start: Stop, b_end: Stop, start_time: str):
+        time = time_to_minutes(start_time)
+        graph = self.graph
+        labels = self.labels
+        scan_labels = self.scan_labels
+        scan_labels[labels.touched] = 1e10
+        labels.reset()
+        arrival, last_stops, last_routes, last_lines = labels.min_arrival_minutes, labels.last_stop, labels.last_route, labels.last_line
+        start = graph.stop_ids[a_start]
+        # without a target every stop is scanned for
+        end = graph.stop_ids[b_end] if b_end is not None else None
+        labels.touch(start)
+        if end is not None:
+            labels.touch(end)
+        arrival[start] = time
+        scan_labels[start] = time
+        day = time // day_minutes
+        index = bisect_left(self.scan_departures, time % day_minutes)
+        last_improvement = time
+        scanning = len(self.conns) > 0
+        stats = self.stats
+        while scanning:
+            for chunk in range(index, len(self.conns), chunk_size):
+                departures = self.scan_departures[chunk:chunk+chunk_size] + day * day_minutes
+                if end is not None and departures[0] >= arrival[end]:
+                    scanning = False
+                    break
+                # nothing improved for a whole day, the following days would repeat it
+                if departures[0] > last_improvement + day_minutes:
+                    scanning = False
+                    break
+                arrivals = self.scan_arrivals[chunk:chunk+chunk_size] + day * day_minutes
+                # derive real cost adding day if you were on a road during midnight
+                arrivals += np.where(self.scan_arrivals[chunk:chunk+chunk_size] < self.scan_departures[chunk:chunk+chunk_size], day_minutes, 0)
+                sources = self.scan_sources[chunk:chunk+chunk_size]
+                targets = self.scan_targets[chunk:chunk+chunk_size]
+                # labels only decrease, so a connection not improving the label from before the chunk,
+                # or leaving before the best arrival at its start the chunk could give, can be skipped;
+                # the best arrivals spread from the reached stops over the chunk until no more connections are boarded,
+                # with the labels of the targets lowered in place and put back after it
+                saved = scan_labels[targets]
+                improving = arrivals < saved
+                useful = improving & (scan_labels[sources] <= departures)
+                while True:
+                    np.minimum.at(scan_labels, targets[useful], arrivals[useful])
+                    boarded = improving & (scan_labels[sources] <= departures)
+                    if np.array_equal(boarded, useful):
+                        break
+                    useful = boarded
+                scan_labels[targets] = saved
+                candidates = np.flatnonzero(useful)
+                # the connections left by the numpy checks
+                if stats is not None:
+                    stats.relaxed += len(candidates)
+                for i, departure, arrival_, source, target, line in zip((candidates + chunk).tolist(), departures[candidates].tolist(), arrivals[candidates].tolist(),
+                                                                       sources[candidates].tolist(), targets[candidates].tolist(), self.scan_lines[chunk:chunk+chunk_size][candidates].tolist()):
+                    if end is not None and departure >= arrival[end]:
+                        break
+                    labels.touch(source)
+                    labels.touch(target)
+                    # take time for a change of line
+                    change_fine = 0 if line == last_lines[source] else change_minutes
+                    if arrival[source] + change_fine <= departure and arrival_ < arrival[target]:
+                        arrival[target] = arrival_
+                        scan_labels[target] = arrival_
+                        last_lines[target] = line
+                        last_stops[target] = source
+                        last_routes[target] = int(self.conns[i])
+                        last_improvement = departure
+            else:
+                # go on with the connections of the next day
+                day += 1
+                index = 0
+
+def run(a_start: Stop, b_end: Stop, start_time: str) -> None:
+    c = ConnectionScan()
+    c.run(a_start, b_end, start_time)
+
+if __name__ == '__main__':
+    start = Stop("Tramwajowa", 51.10446678,17.08466997)
+    end = Stop("Muchobór Wielki", 51.09892535,16.94155277)
+    start_time = '23:53:00'
+    run(start, end, start_time)
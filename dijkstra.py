@@ -1,93 +1,220 @@
-import pandas as pd
 from typing import List, Dict, Tuple
-from dataclasses import dataclass
-from tools import Stop, Route, format_time, time_to_minutes, Algorithm, change_minutes
+import numpy as np
+from tools import Stop, Route, Frontier, Labels, format_time, time_to_minutes, Algorithm
 import time as tm
 import sys
 
-@dataclass
-class StopRecord():
-    min_arrival_minutes: int
-    last_stop: Stop
-    last_route: Route
-
 class Dijkstra(Algorithm):
-    def __init__(self, filename="connection_graph (1).csv") -> None:
-        super().__init__(filename)
+    def __init__(self, graph="connection_graph (1).csv", target_pruning: bool = True, bidirectional: bool = False) -> None:
+        # target_pruning stops a query once its target is settled, instead of settling every stop;
+        # bidirectional meets it with a backward search of lower bounds from the target, built in _create
+        self.target_pruning = target_pruning
+        self.bidirectional = bidirectional
+        # the lower bounds are the ride times of the timetable
+        self.indexes_times = self.indexes_times or bidirectional
+        super().__init__(graph)
 
     def _create(self):
-        self.graph: Dict[Stop, Dict[Stop, List[Route]]] = {}
-        for stop in self.data.itertuples():
-            start_stop: Stop = Stop(stop.start_stop, stop.start_stop_lat, stop.start_stop_lon) 
-            end_stop: Stop = Stop(stop.end_stop, stop.end_stop_lat, stop.end_stop_lon)
-            route: Route = Route(line=stop.line, departure_minutes=time_to_minutes(stop.departure_time), arrival_minutes=time_to_minutes(stop.arrival_time))
-            if start_stop not in self.graph.keys():
-                self.graph[start_stop] = {end_stop: [route]}
-            elif end_stop in self.graph[start_stop].keys():
-             self.graph[start_stop][end_stop].append(route)
-            else:
-                self.graph[start_stop][end_stop] = [route] 
-            if end_stop not in self.graph.keys():
-                self.graph[end_stop] = {}
-        for stop, neighbors in self.graph.items():
-            for _, routes in neighbors.items():
-                routes.sort(key=lambda rt: rt.arrival_minutes)   
-                
-    def _proceed(self, a_start: Stop, _, start_time: str):
+        # labels of the stops, reused by every query
+        graph = self.graph
+        n = len(graph.stops)
+        self.labels = Labels(n, min_arrival_minutes=1e10, last_stop=None, last_route=None)
+        if self.bidirectional:
+            # reverse adjacency: the edges grouped by their target, weighted by their shortest ride (as in landmarks)
+            order = np.argsort(graph.edge_targets, kind='stable')
+            sources = np.repeat(np.arange(n), np.diff(graph.edge_offsets))
+            self.reverse_offsets = np.searchsorted(graph.edge_targets[order], np.arange(n+1)).tolist()
+            self.reverse_sources = sources[order].tolist()
+            self.reverse_edges = order.tolist()
+            self.reverse_weights = graph.edge_durations()[order].tolist()
+            # minutes of riding from a stop to the target at least, and the edge it starts with
+            self.backward_labels = Labels(n, lower_bound=1e10, next_edge=None)
+
+    def _proceed(self, a_start: Stop, b_end: Stop, start_time: str):
+        sources = [(self.graph.stop_ids[a_start], time_to_minutes(start_time))]
+        # without a target (run_all) every stop is settled
+        target = self.graph.stop_ids[b_end] if b_end is not None and self.target_pruning else None
+        if target is not None and self.bidirectional:
+            self._search_bidirectional(sources, target)
+        else:
+            self._search(sources, target)
+
+    def _search(self, sources: List[Tuple[int, int]], target: int = None):
+        self._refresh()
+        # earliest arrivals from any of the (stop id, time) sources, e.g. the stops walked to from an address
+        graph = self.graph
+        labels = self.labels
+        labels.reset()
+        min_arrivals, last_stops, last_routes = labels.min_arrival_minutes, labels.last_stop, labels.last_route
+        frontier = Frontier()
+        for start, time in sources:
+            labels.touch(start)
+            if time < min_arrivals[start]:
+                min_arrivals[start] = time
+                # stop ids break ties between stops reached at the same time
+                frontier.push(start, time, start)
+        stats = self.stats
+        while(len(frontier) > 0):
+            if stats is not None:
+                stats.frontier(len(frontier.heap))
+            curr_stop = frontier.pop()
+            # the arrival at a settled stop is final
+            if curr_stop == target:
+                return
+            if stats is not None:
+                stats.settled += 1
+                stats.relaxed += int(graph.edge_offsets[curr_stop+1] - graph.edge_offsets[curr_stop])
+            curr_arrival = min_arrivals[curr_stop]
+            last_line = graph.conn_lines[last_routes[curr_stop]] if last_routes[curr_stop] is not None else None
+            for edge in range(graph.edge_offsets[curr_stop], graph.edge_offsets[curr_stop+1]):
+                neighbor = int(graph.edge_targets[edge])
+                min_arrival_minutes, conn = graph.arrival_after(edge, curr_arrival, last_line)
+                labels.touch(neighbor)
+                if min_arrival_minutes < min_arrivals[neighbor]:
+                    min_arrivals[neighbor] = min_arrival_minutes
+                    last_stops[neighbor] = curr_stop
+                    last_routes[neighbor] = conn
+                    frontier.push(neighbor, min_arrival_minutes, neighbor)
+
+    def _search_bidirectional(self, sources: List[Tuple[int, int]], target: int):
+        # the forward search above, alternating with a static search of lower bounds backwards from the target;
+        # the first stop settled both ways gives an upper bound of the arrival by riding on along the backward tree,
+        # and once every stop bounded below it is settled backwards, the other stops cannot be on the best route;
+        # stops whose arrival plus lower bound exceeds it are not searched on either
+        self._refresh()
+        graph = self.graph
+        labels = self.labels
+        labels.reset()
+        min_arrivals, last_stops, last_routes = labels.min_arrival_minutes, labels.last_stop, labels.last_route
+        backward = self.backward_labels
+        backward.reset()
+        bounds, next_edges = backward.lower_bound, backward.next_edge
+        frontier = Frontier()
+        for start, time in sources:
+            labels.touch(start)
+            if time < min_arrivals[start]:
+                min_arrivals[start] = time
+                frontier.push(start, time, start)
+        begin = min(time for _, time in sources)
+        labels.touch(target)
+        backward_frontier = Frontier()
+        backward.touch(target)
+        bounds[target] = 0
+        backward_frontier.push(target, 0, target)
+        # settled both ways: forward in frontier.closed, backward in backward_frontier.closed
+        forward_settled, backward_settled = frontier.closed, backward_frontier.closed
+        best = 1e10
+        # stops not settled backwards yet are at least this far from the target
+        horizon = 0
+        backward_done = False
+        stats = self.stats
+        while(len(frontier) > 0):
+            if not backward_done:
+                stop = backward_frontier.pop()
+                if stop is None or bounds[stop] > best - begin:
+                    backward_done = True
+                else:
+                    horizon = bounds[stop]
+                    if best == 1e10 and stop in forward_settled:
+                        best = self._arrival_through(stop)
+                    if stats is not None:
+                        stats.settled += 1
+                        stats.relaxed += self.reverse_offsets[stop+1] - self.reverse_offsets[stop]
+                    for i in range(self.reverse_offsets[stop], self.reverse_offsets[stop+1]):
+                        source = self.reverse_sources[i]
+                        backward.touch(source)
+                        bound = bounds[stop] + self.reverse_weights[i]
+                        if bound < bounds[source]:
+                            bounds[source] = bound
+                            next_edges[source] = self.reverse_edges[i]
+                            backward_frontier.push(source, bound, source)
+            if stats is not None:
+                stats.frontier(len(frontier.heap) + len(backward_frontier.heap))
+            curr_stop = frontier.pop()
+            if curr_stop is None or curr_stop == target:
+                return
+            if stats is not None:
+                stats.settled += 1
+                stats.relaxed += int(graph.edge_offsets[curr_stop+1] - graph.edge_offsets[curr_stop])
+            if best == 1e10 and curr_stop in backward_settled:
+                best = self._arrival_through(curr_stop)
+            curr_arrival = min_arrivals[curr_stop]
+            last_line = graph.conn_lines[last_routes[curr_stop]] if last_routes[curr_stop] is not None else None
+            for edge in range(graph.edge_offsets[curr_stop], graph.edge_offsets[curr_stop+1]):
+                neighbor = int(graph.edge_targets[edge])
+                if backward_done and neighbor not in backward_settled:
+                    continue
+                min_arrival_minutes, conn = graph.arrival_after(edge, curr_arrival, last_line)
+                labels.touch(neighbor)
+                if min_arrival_minutes < min_arrivals[neighbor]:
+                    # riding on takes at least the lower bound, past the best arrival the stop is of no use
+                    if min_arrival_minutes + (bounds[neighbor] if neighbor in backward_settled else horizon) > best:
+                        continue
+                    min_arrivals[neighbor] = min_arrival_minutes
+                    last_stops[neighbor] = curr_stop
+                    last_routes[neighbor] = conn
+                    frontier.push(neighbor, min_arrival_minutes, neighbor)
+
+    def _arrival_through(self, stop: int) -> int:
+        # arrival at the target from the stop settled both ways, riding the edges of the backward tree in time
+        graph = self.graph
+        next_edges = self.backward_labels.next_edge
+        time = self.labels.min_arrival_minutes[stop]
+        last_line = graph.conn_lines[self.labels.last_route[stop]] if self.labels.last_route[stop] is not None else None
+        while next_edges[stop] is not None:
+            edge = next_edges[stop]
+            time, conn = graph.arrival_after(edge, time, last_line)
+            if conn is None:
+                return 1e10
+            last_line = graph.conn_lines[conn]
+            stop = int(graph.edge_targets[edge])
+        return time
+
+    def run_all(self, a_start: Stop, start_time: str, itineraries: bool = True) -> Dict[Stop, Tuple[int, List[Tuple[Stop, Route, Stop, int]]]]:
+        # one search answers every destination: stop -> (cost, itinerary), unreachable stops are left out
+        with self._query(a_start, None, start_time):
+            with self._phase("proceeding"):
+                self._proceed(a_start, None, start_time)
         time = time_to_minutes(start_time)
-        self.stops_records: Dict[Stop, StopRecord] = {} 
-        for key in self.graph.keys():
-            self.stops_records[key] = StopRecord(1e10, None, None)
-        self.stops_records[a_start] = StopRecord(time, None, None)
-        unseen_stops = list(self.graph.keys())
-        while(len(unseen_stops) > 0):
-            curr_stop = unseen_stops[0]
-            for stop in unseen_stops:
-                if self.stops_records[stop].min_arrival_minutes < self.stops_records[curr_stop].min_arrival_minutes:
-                    curr_stop = stop
-            unseen_stops.remove(curr_stop)
-            # normalize arrival time to 24h
-            arrival_minutes_modulo = self.stops_records[curr_stop].min_arrival_minutes % (24*60) 
-            for neighbor, routes in self.graph[curr_stop].items():
-                min_arrival_id = -1
-                for i in range(len(routes)):
-                    # take time for a change of line
-                    change_fine = 0 if self.stops_records[curr_stop].last_route is not None and routes[i].line == self.stops_records[curr_stop].last_route.line else change_minutes
-                    if arrival_minutes_modulo + change_fine <= routes[i].departure_minutes:
-                        min_arrival_id = i
-                        break
-                # if there are no more this day, take the first one after midnight...
-                min_arrival_minutes = routes[min_arrival_id].arrival_minutes if min_arrival_id > -1 else 24*60+routes[0].arrival_minutes
-                # ...therefore, this is the chosen route id
-                min_arrival_id = max(min_arrival_id,0)
-                # derive real cost including days already travelled (anti-prior-normalization)
-                min_arrival_minutes += (self.stops_records[curr_stop].min_arrival_minutes // (24*60)) * 24*60
-                # derive real cost adding day if you were on a road during midnight
-                min_arrival_minutes += 0 if routes[min_arrival_id].arrival_minutes >= routes[min_arrival_id].departure_minutes else 24*60
-                if min_arrival_minutes < self.stops_records[neighbor].min_arrival_minutes:
-                    self.stops_records[neighbor].min_arrival_minutes = min_arrival_minutes
-                    self.stops_records[neighbor].last_stop = curr_stop
-                    self.stops_records[neighbor].last_route = routes[min_arrival_id]
-                    
-    def _print(self, a_start: Stop, b_end: Stop, start_time: str) -> None:
-        temp = b_end, self.stops_records[b_end]
-        route: List[Tuple[Stop, StopRecord]] = []
-        max_length = [0,0,0,0,0]
-        while temp[1].last_stop is not None:
-            route.append(temp)
-            for i, element in enumerate([temp[1].last_route.line, temp[1].last_stop.name, format_time(temp[1].last_route.departure_minutes), temp[0].name, format_time(temp[1].last_route.arrival_minutes)]):
-                max_length[i] = len(str(element)) if len(str(element)) > max_length[i] else max_length[i]
-            temp = temp[1].last_stop, self.stops_records[temp[1].last_stop]
+        min_arrivals = self.labels.min_arrival_minutes
+        return {self.graph.stops[stop]: (min_arrivals[stop] - time, self._itinerary(stop) if itineraries else None)
+                for stop in sorted(self.labels.touched) if min_arrivals[stop] < 1e10}
+
+    def _itinerary(self, end: int) -> List[Tuple[Stop, Route, Stop, int]]:
+        # (from, route, to, arrival) steps leading to the stop
+        graph = self.graph
+        labels = self.labels
+        # a stop the query has not reached has no steps
+        labels.touch(end)
+        stop = end
+        route: List[Tuple[Stop, Route, Stop, int]] = []
+        while labels.last_stop[stop] is not None:
+            route.append((graph.stops[labels.last_stop[stop]], graph.route(labels.last_route[stop]), graph.stops[stop], labels.min_arrival_minutes[stop]))
+            stop = labels.last_stop[stop]
         route.reverse()
+        return route
+
+    def _print(self, a_start: Stop, b_end: Stop, start_time: str) -> None:
         print(f"From {a_start.name} at {start_time}:")
-        for i, stop in enumerate(route):
-            day_info = "Day " +  str(stop[1].min_arrival_minutes // (24*60) + 1)
-            print(f"{str(i+1).rjust(len(str(len(route))))}. \t{str(stop[1].last_route.line).rjust(max_length[0])}) [{format_time(stop[1].last_route.departure_minutes).rjust(max_length[2])}] {stop[1].last_stop.name.ljust(max_length[1])} - "
-                f"[{format_time(stop[1].last_route.arrival_minutes)}] {stop[0].name} ({day_info})")
+        print_itinerary(self._itinerary(self.graph.stop_ids[b_end]))
         print(f'Cost function: {self._cost(a_start, b_end, start_time)}', file=sys.stderr)
 
     def _cost(self, a_start: Stop, b_end: Stop, start_time: str) -> int:
-        return self.stops_records[b_end].min_arrival_minutes - time_to_minutes(start_time)
+        # None when the stop cannot be reached, as in the other engines
+        end = self.graph.stop_ids[b_end]
+        self.labels.touch(end)
+        arrival = self.labels.min_arrival_minutes[end]
+        return arrival - time_to_minutes(start_time) if arrival < 1e10 else None
+
+def print_itinerary(route: List[Tuple[Stop, Route, Stop, int]]) -> None:
+    max_length = [0,0,0,0,0]
+    for step in route:
+        for i, element in enumerate([step[1].line, step[0].name, format_time(step[1].departure_minutes), step[2].name, format_time(step[1].arrival_minutes)]):
+            max_length[i] = len(str(element)) if len(str(element)) > max_length[i] else max_length[i]
+    for i, (last_stop, last_route, stop, min_arrival_minutes) in enumerate(route):
+        day_info = "Day " +  str(min_arrival_minutes // (24*60) + 1)
+        print(f"{str(i+1).rjust(len(str(len(route))))}. \t{str(last_route.line).rjust(max_length[0])}) [{format_time(last_route.departure_minutes).rjust(max_length[2])}] {last_stop.name.ljust(max_length[1])} - "
+            f"[{format_time(last_route.arrival_minutes)}] {stop.name} ({day_info})")
 
 def run(a_start: Stop, b_end: Stop, start_time: str) -> None:
     d = Dijkstra()
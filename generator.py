@@ -0,0 +1,64 @@
+from typing import List, Tuple, Sequence
+import random
+import sys
+import pandas as pd
+
+columns = ['company', 'line', 'departure_time', 'arrival_time', 'start_stop', 'end_stop',
+           'start_stop_lat', 'start_stop_lon', 'end_stop_lat', 'end_stop_lon']
+
+def format_clock(minutes: int) -> str:
+    # hours go past 24 for trips after midnight, as in the timetable exports
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+def generate(n_stops: int = 300, n_lines: int = 60, headways: Sequence[int] = (7, 10, 15, 20, 30), first_departure: int = 4*60,
+             last_departure: int = 25*60, line_stops: Tuple[int, int] = (6, 16), hop_minutes: Tuple[int, int] = (1, 4),
+             seed: int = 0) -> pd.DataFrame:
+    # stops on a jittered grid around Wrocław, every line is a random walk over neighbouring stops served in both directions
+    # every headway minutes from first to last departure (in minutes, past 24*60 the trips cross midnight)
+    rng = random.Random(seed)
+    side = int(n_stops ** 0.5) + 1
+    stops: List[Tuple[str, float, float]] = []
+    for i in range(n_stops):
+        x, y = i % side, i // side
+        stops.append((f"Przystanek {i}", 51.05 + 0.01*y + rng.uniform(-0.002, 0.002), 16.95 + 0.015*x + rng.uniform(-0.002, 0.002)))
+    rows = []
+    for line in range(n_lines):
+        stop = rng.randrange(n_stops)
+        path = [stop]
+        length = rng.randint(*line_stops)
+        # walking back onto the path is skipped, give up after twice the length
+        for _ in range(length * 2):
+            if len(path) >= length:
+                break
+            x, y = stop % side, stop // side
+            neighbors = [(x+dx) + (y+dy)*side for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                         if 0 <= x+dx < side and 0 <= y+dy < side and (x+dx) + (y+dy)*side < n_stops]
+            stop = rng.choice(neighbors)
+            if stop not in path:
+                path.append(stop)
+        if len(path) < 2:
+            continue
+        hops = [rng.randint(*hop_minutes) for _ in path]
+        headway = rng.choice(headways)
+        for direction in (path, path[::-1]):
+            departure = first_departure + rng.randrange(headway)
+            while departure <= last_departure:
+                time = departure
+                for a, b, hop in zip(direction, direction[1:], hops):
+                    rows.append(('MPK', str(line), format_clock(time), format_clock(time + hop), stops[a][0], stops[b][0],
+                                 stops[a][1], stops[a][2], stops[b][1], stops[b][2]))
+                    # vehicles wait at some stops
+                    time += hop + rng.choice((0, 0, 1))
+                departure += headway
+    rng.shuffle(rows)
+    return pd.DataFrame(rows, columns=columns)
+
+def write(data: pd.DataFrame, filename: str) -> None:
+    # same layout as the original csv, with an unnamed index column first
+    data.to_csv(filename, index=True, encoding='utf-8')
+
+if __name__ == '__main__':
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'synthetic.csv'
+    data = generate(*[int(arg) for arg in sys.argv[2:4]])
+    write(data, filename)
+    print(f"{len(data)} connections written to {filename}", file=sys.stderr)
@@ -0,0 +1,70 @@
+from typing import List, Dict
+import heapq
+import time as tm
+import numpy as np
+from timetable import Timetable
+
+# minutes standing for an unreachable stop in the tables
+unreachable = int(np.iinfo(np.uint16).max)
+
+def static_distances(offsets: List[int], targets: List[int], weights: List[int], source: int) -> np.ndarray:
+    # plain Dijkstra from the source over a static graph in CSR layout
+    distances = [unreachable] * (len(offsets) - 1)
+    distances[source] = 0
+    heap = [(0, source)]
+    while heap:
+        distance, stop = heapq.heappop(heap)
+        if distance > distances[stop]:
+            continue
+        for edge in range(offsets[stop], offsets[stop+1]):
+            new_distance = distance + weights[edge]
+            if new_distance < distances[targets[edge]]:
+                distances[targets[edge]] = new_distance
+                heapq.heappush(heap, (new_distance, targets[edge]))
+    return np.minimum(np.array(distances), unreachable).astype(np.uint16)
+
+class Landmarks:
+    # ALT lower bounds: shortest ride times (waiting left out) from and to k landmark stops over the stop graph,
+    # by the triangle inequality travel(v, t) >= d(L, t) - d(L, v) and travel(v, t) >= d(v, L) - d(t, L)
+    def __init__(self, graph: Timetable, k: int = 16) -> None:
+        begin = tm.perf_counter()
+        n = len(graph.stops)
+        weights = graph.edge_durations()
+        forward = graph.edge_offsets.tolist(), graph.edge_targets.tolist(), weights.tolist()
+        # reverse adjacency, the edges grouped by their target
+        sources = np.repeat(np.arange(n), np.diff(graph.edge_offsets))
+        order = np.argsort(graph.edge_targets, kind='stable')
+        backward = np.searchsorted(graph.edge_targets[order], np.arange(n+1)).tolist(), sources[order].tolist(), weights[order].tolist()
+        self.stops: List[int] = []
+        from_rows: List[np.ndarray] = []
+        to_rows: List[np.ndarray] = []
+        # farthest-point selection, starting with the stop farthest from the centre;
+        # every next landmark is the stop farthest from the chosen ones both ways
+        latitudes, longitudes = graph.latitudes - graph.latitudes.mean(), graph.longitudes - graph.longitudes.mean()
+        candidate = int(np.argmax(latitudes**2 + longitudes**2)) if n > 0 else None
+        nearest = np.full(n, np.inf)
+        for _ in range(min(k, n)):
+            self.stops.append(candidate)
+            from_rows.append(static_distances(*forward, candidate))
+            to_rows.append(static_distances(*backward, candidate))
+            both = np.where((from_rows[-1] < unreachable) & (to_rows[-1] < unreachable), from_rows[-1].astype(np.int64) + to_rows[-1], 0)
+            nearest = np.minimum(nearest, both)
+            nearest[self.stops] = -1
+            candidate = int(np.argmax(nearest))
+        # (landmark, stop) tables of minutes, signed once here so the queries subtract them as they are
+        self.from_landmarks = np.array(from_rows, dtype=np.int32).reshape(len(self.stops), n)
+        self.to_landmarks = np.array(to_rows, dtype=np.int32).reshape(len(self.stops), n)
+        self.build_seconds = tm.perf_counter() - begin
+
+    def lower_bounds(self, end: int) -> np.ndarray:
+        # minutes of riding every stop needs at least to reach the end
+        from_landmarks, to_landmarks = self.from_landmarks, self.to_landmarks
+        from_end = from_landmarks[:, end:end+1]
+        to_end = to_landmarks[:, end:end+1]
+        # only landmarks reaching (reached from) both stops bound the travel
+        forward = np.where((from_landmarks < unreachable) & (from_end < unreachable), from_end - from_landmarks, 0)
+        backward = np.where((to_landmarks < unreachable) & (to_end < unreachable), to_landmarks - to_end, 0)
+        return np.maximum(np.maximum(forward, backward).max(axis=0, initial=0), 0)
+
+    def report(self) -> Dict[str, float]:
+        return {'landmarks': len(self.stops), 'seconds': self.build_seconds, 'bytes': self.from_landmarks.nbytes + self.to_landmarks.nbytes}
@@ -0,0 +1,93 @@
+from typing import List, Dict
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time as tm
+import numpy as np
+from tools import format_time
+
+class Connection:
+    # one client connection, requests are pipelined and matched to the responses by id
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.waiting: Dict[int, asyncio.Future] = {}
+        self.ids = itertools.count()
+        self.receiving = asyncio.create_task(self._receive())
+
+    @staticmethod
+    async def open(host: str, port: int) -> "Connection":
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 24)
+        return Connection(reader, writer)
+
+    async def request(self, request: Dict[str, object]) -> Dict[str, object]:
+        request = dict(request, id=next(self.ids))
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[request['id']] = future
+        self.writer.write((json.dumps(request, ensure_ascii=False) + '\n').encode())
+        await self.writer.drain()
+        return await future
+
+    async def _receive(self) -> None:
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            response = json.loads(line)
+            self.waiting.pop(response['id']).set_result(response)
+        for future in self.waiting.values():
+            future.set_exception(ConnectionError("Connection closed by the server"))
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiving.cancel()
+
+async def run(host: str = '127.0.0.1', port: int = 8765, n_queries: int = 1000, connections: int = 8, in_flight: int = 4,
+              batch_size: int = 1, criteria: str = 'dtpcr', seed: int = 0) -> Dict[str, object]:
+    # every connection keeps in_flight requests of batch_size random queries on the way
+    opened = [await Connection.open(host, port) for _ in range(connections)]
+    stops = (await opened[0].request({'op': 'stops'}))['stops']
+    rng = random.Random(seed)
+    queries = [{'start': a, 'end': b, 'time': format_time(rng.randrange(24*60)) + ':00', 'criteria': rng.choice(criteria)}
+               for a, b in (rng.sample(stops, 2) for _ in range(n_queries))]
+    requests = [{'batch': queries[i:i+batch_size]} if batch_size > 1 else queries[i] for i in range(0, len(queries), batch_size)]
+    pending = iter(requests)
+    latencies: List[float] = []
+    errors = 0
+
+    async def send(connection: Connection) -> None:
+        nonlocal errors
+        for request in pending:
+            begin = tm.perf_counter()
+            response = await connection.request(request)
+            latencies.append(tm.perf_counter() - begin)
+            results = response['results'] if 'results' in response else [response]
+            errors += sum('error' in result for result in results)
+
+    begin = tm.perf_counter()
+    await asyncio.gather(*[send(connection) for connection in opened for _ in range(in_flight)])
+    seconds = tm.perf_counter() - begin
+    for connection in opened:
+        await connection.close()
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+    return {'queries': n_queries, 'requests': len(requests), 'errors': errors, 'connections': connections, 'in_flight': in_flight,
+            'batch_size': batch_size, 'seconds': seconds, 'queries_per_second': n_queries / seconds,
+            'latency': {'mean': float(np.mean(latencies)), 'p50': p50, 'p95': p95, 'p99': p99, 'max': max(latencies)}}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Throughput and latency of a running query server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--in-flight', type=int, default=4, help="requests on the way per connection")
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--criteria', default='dtpcr')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    report = asyncio.run(run(args.host, args.port, args.queries, args.connections, args.in_flight, args.batch_size, args.criteria, args.seed))
+    json.dump(report, sys.stdout, indent=2)
@@ -0,0 +1,279 @@
+from typing import List, Dict, Tuple
+from bisect import bisect_left
+from dataclasses import dataclass
+import sys
+import numpy as np
+from tools import Stop, Route, StopLine, Labels, format_time, time_to_minutes, Algorithm, change_minutes
+from timetable import day_minutes, tombstone
+from dijkstra import print_itinerary
+
+# a vehicle waiting at a stop for less than this is still the same trip (as in AStarChanges)
+max_dwell_minutes = 1
+
+@dataclass
+class StopRecord():
+    arrival: int
+    boarding: int
+    first_route: int
+    last_route: int
+
+class Raptor(Algorithm):
+    # round-based search: round k holds the earliest arrivals using at most k trips;
+    # trips are rebuilt by chaining the connections of a line through the stops, the trips of a line over the same stops
+    # make a route, and every round scans each route once from the first of its stops reached in the round before
+    indexes_times = True
+
+    def __init__(self, graph="connection_graph (1).csv", max_rounds: int = 16) -> None:
+        super().__init__(graph)
+        self.max_rounds = max_rounds
+
+    def _create(self):
+        graph = self.graph
+        sources, targets = graph.connection_stops()
+        lines = graph.conn_lines.astype(np.int64)
+        n_lines = max(len(graph.lines), 1)
+        # every connection keyed by (start stop, line, departure)
+        keys = (sources.astype(np.int64) * n_lines + lines) * day_minutes + graph.departures
+        # removed connections are never ridden on with
+        keys[graph.departures == tombstone] = -1
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        base = (targets.astype(np.int64) * n_lines + lines) * day_minutes
+        # the connection the vehicle goes on with, -1 at the end of a trip
+        next_conns = np.full(len(keys), -1, dtype=np.int64)
+        for dwell in range(max_dwell_minutes + 1):
+            wanted = base + (graph.arrivals.astype(np.int64) + dwell) % day_minutes
+            first = np.searchsorted(sorted_keys, wanted, 'left')
+            last = np.searchsorted(sorted_keys, wanted, 'right')
+            # a connection going straight back is the opposite direction of the line, try the one after it
+            for shift in range(2):
+                candidates = order[np.minimum(first + shift, len(order)-1)]
+                found = (first + shift < last) & (targets[candidates] != sources) & (next_conns == -1)
+                next_conns = np.where(found, candidates, next_conns)
+        self.next_conns = next_conns.tolist()
+        self.conn_targets = targets
+        self._create_routes(next_conns)
+        # earliest arrival at every stop over all the rounds
+        self.labels = Labels(len(graph.stops), best=1e10)
+
+    def _create_routes(self, next_conns: np.ndarray) -> None:
+        graph = self.graph
+        sources, targets = graph.connection_stops()
+        departures, arrivals = graph.departures.astype(np.int64), graph.arrivals.astype(np.int64)
+        live = graph.departures != tombstone
+        followed = np.zeros(len(next_conns), dtype=bool)
+        followed[next_conns[next_conns != -1]] = True
+        # trips start at the connections no other one goes on with, then at any connection left (of circular trips)
+        columns = self._trips(np.flatnonzero(live & ~followed), next_conns, departures, arrivals)
+        left = live.copy()
+        left[columns[2]] = False
+        if left.any():
+            more = self._trips(np.flatnonzero(left), next_conns, departures, arrivals)
+            columns = [np.concatenate([columns[0], more[0] + (columns[0].max() + 1 if len(columns[0]) else 0)])] + \
+                      [np.concatenate([a, b]) for a, b in zip(columns[1:], more[1:])]
+        order = np.lexsort((columns[1], columns[0]))
+        trips, conns, trip_departures, trip_arrivals = [column[order] for column in (columns[0], columns[2], columns[3], columns[4])]
+        starts = np.flatnonzero(np.diff(trips, prepend=-1) != 0)
+        lengths = np.diff(np.append(starts, len(trips)))
+        # the trips of a line over the same stops
+        conn_list, target_list, lines = conns.tolist(), targets[conns].tolist(), graph.conn_lines[conns].tolist()
+        groups: Dict[Tuple[int, ...], List[int]] = {}
+        for trip, (first, length) in enumerate(zip(starts.tolist(), lengths.tolist())):
+            key = (lines[first], int(sources[conn_list[first]]), *target_list[first:first+length])
+            groups.setdefault(key, []).append(trip)
+        # the trips of a route are sorted by departure, a trip overtaking another goes to a route of its own,
+        # so the first trip leaving a stop arrives first at all the stops after it
+        self.route_stops: List[List[int]] = []
+        self.route_conns: List[List[List[int]]] = []
+        # departures from stop i of the route and arrivals at stop i+1, trip by trip,
+        # in minutes from the midnight before the trip starts
+        self.route_departures: List[List[List[int]]] = []
+        self.route_arrivals: List[List[List[int]]] = []
+        # (route, position) of the routes leaving every stop
+        self.stop_routes: List[List[Tuple[int, int]]] = [[] for _ in graph.stops]
+        for key, group in groups.items():
+            stops = list(key[1:])
+            positions = starts[group][:, None] + np.arange(len(stops) - 1)
+            route_departures, route_arrivals = trip_departures[positions], trip_arrivals[positions]
+            rows = np.lexsort(route_departures.T[::-1])
+            route_conns, route_departures, route_arrivals = conns[positions][rows], route_departures[rows], route_arrivals[rows]
+            if np.all(np.diff(route_departures, axis=0) >= 0) and np.all(np.diff(route_arrivals, axis=0) >= 0):
+                variants = [np.arange(len(rows))]
+            else:
+                variants = self._variants(route_departures.tolist(), route_arrivals.tolist())
+            for variant in variants:
+                route = len(self.route_stops)
+                self.route_stops.append(stops)
+                self.route_conns.append(route_conns[variant].tolist())
+                self.route_departures.append(route_departures[variant].T.tolist())
+                self.route_arrivals.append(route_arrivals[variant].T.tolist())
+                for i, stop in enumerate(stops[:-1]):
+                    self.stop_routes[stop].append((route, i))
+
+    def _trips(self, starts: np.ndarray, next_conns: np.ndarray, departures: np.ndarray, arrivals: np.ndarray) -> List[np.ndarray]:
+        # (trip, position, connection, departure, arrival) columns of the trips starting at the connections,
+        # riding on until the vehicle comes back to the first one or for a day at most; all the trips a step at a time
+        trips, conns = np.arange(len(starts)), starts
+        times = departures[starts]
+        firsts, begins = conns, times
+        columns: List[List[np.ndarray]] = [[] for _ in range(5)]
+        for position in range(len(self.graph.stops)):
+            if len(conns) == 0:
+                break
+            ends = times + (arrivals[conns] - departures[conns]) % day_minutes
+            for column, values in zip(columns, (trips, np.full(len(conns), position), conns, times, ends)):
+                column.append(values)
+            following = next_conns[conns]
+            going = following != -1
+            trips, conns, firsts, begins, ends, following = trips[going], conns[going], firsts[going], begins[going], ends[going], following[going]
+            times = ends + (departures[following] - arrivals[conns]) % day_minutes
+            going = (following != firsts) & (times <= begins + day_minutes)
+            trips, conns, firsts, begins, times = trips[going], following[going], firsts[going], begins[going], times[going]
+        return [np.concatenate(column) if column else np.zeros(0, dtype=np.int64) for column in columns]
+
+    def _variants(self, departures: List[List[int]], arrivals: List[List[int]]) -> List[List[int]]:
+        # the rows (sorted by departure) split into runs never overtaking one another
+        variants: List[List[int]] = []
+        for row in range(len(departures)):
+            for variant in variants:
+                last = variant[-1]
+                if all(a <= b for a, b in zip(departures[last], departures[row])) and all(a <= b for a, b in zip(arrivals[last], arrivals[row])):
+                    variant.append(row)
+                    break
+            else:
+                variants.append([row])
+        return variants
+
+    def _proceed(self, a_start: Stop, b_end: Stop, start_time: str):
+        time = time_to_minutes(start_time)
+        graph = self.graph
+        start = graph.stop_ids[a_start]
+        end = graph.stop_ids[b_end]
+        labels = self.labels
+        labels.reset()
+        best = labels.best
+        labels.touch(start)
+        labels.touch(end)
+        best[start] = time
+        self.rounds: List[Dict[int, StopRecord]] = [{start: StopRecord(time, None, None, None)}]
+        # (arrival, round) of the journeys that are not dominated by one with fewer trips
+        self.pareto: List[Tuple[int, int]] = []
+        # arrivals at the stops improved in the round before, the trips of the round are boarded there only:
+        # a trip caught at any other stop was caught there already in the round after it was improved
+        marked = {start: time}
+        for k in range(1, self.max_rounds + 1):
+            if not marked:
+                break
+            # every route once, from the first of its stops marked in the round before
+            queue: Dict[int, int] = {}
+            for stop in marked:
+                for route, i in self.stop_routes[stop]:
+                    if queue.get(route, i + 1) > i:
+                        queue[route] = i
+            if self.stats is not None:
+                self.stats.settled += len(marked)
+            records: Dict[int, StopRecord] = {}
+            for route, i in queue.items():
+                self._scan(route, i, marked, end, best, records)
+            self.rounds.append(records)
+            marked = {stop: record.arrival for stop, record in records.items()}
+            if end in records:
+                self.pareto.append((records[end].arrival, k))
+
+    def _scan(self, route: int, first: int, marked: Dict[int, int], end: int, best: List[float], records: Dict[int, StopRecord]) -> None:
+        # rides the route from its stop at the position first on, hopping on an earlier trip wherever one can be caught
+        stops, conns = self.route_stops[route], self.route_conns[route]
+        departures, arrivals = self.route_departures[route], self.route_arrivals[route]
+        touch = self.labels.touch
+        trip, shift, boarding, boarded = None, 0, None, None
+        if self.stats is not None:
+            self.stats.relaxed += len(stops) - first
+        for i in range(first, len(stops)):
+            stop = stops[i]
+            if trip is not None:
+                arrival = arrivals[i-1][trip] + shift
+                touch(stop)
+                if arrival < best[stop] and arrival < best[end]:
+                    best[stop] = arrival
+                    records[stop] = StopRecord(arrival, boarding, conns[trip][boarded], conns[trip][i-1])
+            if i == len(stops) - 1:
+                return
+            time = marked.get(stop)
+            # take time for a change of line; the trip ridden already is boarded again here, so it is ridden the least
+            if time is not None and (trip is None or time + change_minutes <= departures[i][trip] + shift):
+                earlier, earlier_shift = self._earliest_trip(departures[i], time + change_minutes)
+                if trip is None or departures[i][earlier] + earlier_shift <= departures[i][trip] + shift:
+                    trip, shift, boarding, boarded = earlier, earlier_shift, stop, i
+
+    def _earliest_trip(self, departures: List[int], time: int) -> Tuple[int, int]:
+        # the trip leaving first at or after the (absolute) time and the minutes its times are shifted by
+        day = time // day_minutes * day_minutes
+        trip = bisect_left(departures, time - day)
+        # without any left this day the first one of the next day is taken, it may also leave before one started late this day
+        if trip == len(departures) or departures[0] + day_minutes < departures[trip]:
+            found, found_shift = 0, day + day_minutes
+        else:
+            found, found_shift = trip, day
+        # trips started the day before may still be on the road
+        if departures[-1] + day - day_minutes >= time:
+            trip = bisect_left(departures, time - day + day_minutes)
+            if departures[trip] + day - day_minutes < departures[found] + found_shift:
+                found, found_shift = trip, day - day_minutes
+        return found, found_shift
+
+    def run_pareto(self, a_start: Stop, b_end: Stop, start_time: str) -> List[Tuple[int, int]]:
+        # (travel time, transfers) of every journey in the Pareto set
+        with self._query(a_start, b_end, start_time):
+            with self._phase("proceeding"):
+                self._proceed(a_start, b_end, start_time)
+        time = time_to_minutes(start_time)
+        return [(arrival - time, k - 1) for arrival, k in self.pareto]
+
+    def legs(self, b_end: Stop, transfers: int) -> List[Tuple[StopLine, List[Tuple[Stop, Route, Stop, int]]]]:
+        # trips of the journey of the last query with that many transfers: the boarding stopline and (from, route, to, arrival) hops
+        graph = self.graph
+        legs = []
+        stop = graph.stop_ids[b_end]
+        k = transfers + 1
+        while k > 0:
+            record = self.rounds[k][stop]
+            conns = [record.first_route]
+            while conns[-1] != record.last_route:
+                conns.append(self.next_conns[conns[-1]])
+            # absolute times are recovered backwards from the arrival at the alighting stop
+            hops = []
+            arrival = record.arrival
+            for i in range(len(conns)-1, -1, -1):
+                route = graph.route(conns[i])
+                source = record.boarding if i == 0 else int(self.conn_targets[conns[i-1]])
+                hops.append((graph.stops[source], route, graph.stops[int(self.conn_targets[conns[i]])], arrival))
+                arrival -= (route.arrival_minutes - route.departure_minutes) % day_minutes
+                if i > 0:
+                    arrival -= (route.departure_minutes - int(graph.arrivals[conns[i-1]])) % day_minutes
+            hops.reverse()
+            legs.append((StopLine(graph.stops[record.boarding], graph.lines[graph.conn_lines[record.first_route]]), hops))
+            stop = record.boarding
+            k -= 1
+        legs.reverse()
+        return legs
+
+    def _print(self, a_start: Stop, b_end: Stop, start_time: str) -> None:
+        print(f"From {a_start.name} at {start_time}:")
+        for arrival, k in self.pareto:
+            print(f"{k - 1} transfers, arrival at {format_time(arrival % day_minutes)} (Day {arrival // day_minutes + 1}):")
+            print_itinerary([hop for _, hops in self.legs(b_end, k - 1) for hop in hops])
+        print(f'Cost function: {self._cost(a_start, b_end, start_time)}', file=sys.stderr)
+
+    def _cost(self, a_start: Stop, b_end: Stop, start_time: str) -> int:
+        # the fewest transfers, the first journey of the Pareto set
+        return self.pareto[0][1] - 1 if self.pareto else None
+
+def run(a_start: Stop, b_end: Stop, start_time: str) -> None:
+    r = Raptor()
+    r.run(a_start, b_end, start_time)
+
+if __name__ == '__main__':
+    start = Stop("Tramwajowa", 51.10446678,17.08466997)
+    end = Stop("Muchobór Wielki", 51.09892535,16.94155277)
+    start_time = '23:53:00'
+    run(start, end, start_time)
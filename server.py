@@ -0,0 +1,164 @@
+from typing import List, Dict, Set, Tuple, Union
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing as mp
+import os
+import re
+import sys
+import numpy as np
+import solution
+from solution import Solution
+from tools import Stop
+
+# line-delimited json over tcp, every request gets one response line with the same id:
+#   {"id": 1, "start": "...", "end": "...", "time": "8:00:00", "criteria": "d"} -> {"id": 1, "cost": ..., "elapsed": ...}
+#     stops are names, resolved as by Solution.find, or [latitude, longitude] points
+#   {"id": 2, "batch": [{...}, ...]} -> {"id": 2, "results": [{"cost": ..., "elapsed": ...}, ...]}, searched by one worker
+#   {"id": 3, "op": "stops"} -> {"id": 3, "stops": [...]}
+# failures are answered with {"id": ..., "error": "..."}; responses come as soon as they are ready, not in order
+
+criteria = ('d', 't', 'p', 'c', 'r')
+# H:MM or H:MM:SS, hours past 24 are the next day as in the timetable
+time_pattern = re.compile(r'\d{1,2}:[0-5]\d(:[0-5]\d)?')
+
+def _answer(query: Dict[str, object]) -> Dict[str, object]:
+    # runs in the workers, on the solution inherited from the server or loaded by solution._init_worker
+    try:
+        if not isinstance(query, dict):
+            raise ValueError("Query must be a json object")
+        if query.get('criteria') not in criteria:
+            raise ValueError(f"wrong criteria {query.get('criteria')!r}, it must be one of {', '.join(criteria)}")
+        points = [_point(query['start']), _point(query['end'])]
+        time = _time(query.get('time'))
+        cost, elapsed = solution._worker_solution.find(*points, time, query['criteria'], debug=False)
+        return {'cost': cost, 'elapsed': elapsed}
+    except Exception as e:
+        return {'error': f"{type(e).__name__}: {e}"}
+
+def _point(point: object) -> Union[str, Tuple[float, float]]:
+    # a stop name the name index resolves, or a (latitude, longitude) point
+    if isinstance(point, str):
+        if Stop(solution._worker_solution.resolve(point),0,0) not in solution._worker_solution.graph.stop_ids:
+            raise ValueError(f"unknown stop {point!r}")
+        return point
+    if isinstance(point, list) and len(point) == 2 and all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in point):
+        return float(point[0]), float(point[1])
+    raise ValueError(f"a stop must be a name or [latitude, longitude], not {point!r}")
+
+def _time(time: object) -> str:
+    if not isinstance(time, str) or not time_pattern.fullmatch(time):
+        raise ValueError(f"a time must be H:MM or H:MM:SS, not {time!r}")
+    return time
+
+def _answer_all(queries: List[Dict[str, object]]) -> List[Dict[str, object]]:
+    return [_answer(query) for query in queries]
+
+def _plain(value: object) -> object:
+    # numpy scalars in the results
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not serializable")
+
+class QueryServer:
+    def __init__(self, filename: str, workers: int = None, max_pending: int = 64, cache_size: int = 1024) -> None:
+        # the graph is loaded once, the workers fork with it already built
+        self.solution = Solution(filename, cache_size)
+        solution._worker_solution = self.solution
+        workers = workers if workers is not None else os.cpu_count()
+        if workers == 0:
+            # searching in a single thread of the server process, engines are not thread-safe
+            self.pool = concurrent.futures.ThreadPoolExecutor(1)
+        elif 'fork' in mp.get_all_start_methods():
+            self.pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=mp.get_context('fork'))
+        else:
+            self.pool = concurrent.futures.ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'),
+                                                               initializer=solution._init_worker, initargs=(filename,))
+        # requests read but not answered yet, over all the connections; when reached, no more lines are read
+        # and the clients are slowed down by tcp
+        self.max_pending = max_pending
+        self.pending: asyncio.Semaphore = None
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765) -> None:
+        self.pending = asyncio.Semaphore(self.max_pending)
+        # batches come in long lines
+        server = await asyncio.start_server(self.handle, host, port, limit=1 << 24)
+        print(f"Serving {len(self.solution.graph.stops)} stops on {host}:{port}", file=sys.stderr)
+        with self.pool:
+            async with server:
+                await server.serve_forever()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        lock = asyncio.Lock()
+        tasks: Set[asyncio.Task] = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, ValueError):
+                    break
+                if not line:
+                    break
+                # the next line of the connection is read only once there is room for it
+                await self.pending.acquire()
+                task = asyncio.create_task(self._respond(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _respond(self, line: bytes, writer: asyncio.StreamWriter, lock: asyncio.Lock) -> None:
+        try:
+            response = await self._dispatch(line)
+        finally:
+            self.pending.release()
+        async with lock:
+            writer.write((json.dumps(response, default=_plain, ensure_ascii=False) + '\n').encode())
+            await writer.drain()
+
+    async def _dispatch(self, line: bytes) -> Dict[str, object]:
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {'id': None, 'error': f"Invalid json: {e}"}
+        if not isinstance(request, dict):
+            return {'id': None, 'error': "Request must be a json object"}
+        loop = asyncio.get_running_loop()
+        op = request.get('op', 'find')
+        if op == 'stops':
+            return {'id': request.get('id'), 'stops': [stop.name for stop in self.solution.graph.stops]}
+        if op != 'find':
+            return {'id': request.get('id'), 'error': f"Unknown op {op!r}"}
+        if 'batch' in request and not isinstance(request['batch'], list):
+            return {'id': request.get('id'), 'error': "Batch must be a list of queries"}
+        try:
+            if 'batch' in request:
+                results = await loop.run_in_executor(self.pool, _answer_all, request['batch'])
+                return {'id': request.get('id'), 'results': results}
+            response = await loop.run_in_executor(self.pool, _answer, request)
+        except Exception as e:
+            # a broken pool or a query the workers cannot take, the client still gets its answer
+            return {'id': request.get('id'), 'error': f"{type(e).__name__}: {e}"}
+        response['id'] = request.get('id')
+        return response
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Line-delimited json query server keeping the graph loaded")
+    parser.add_argument('filename', nargs='?', default="connection_graph (1).csv")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, help="search processes, the cpu count by default, 0 searches in the server process")
+    parser.add_argument('--max-pending', type=int, default=64)
+    parser.add_argument('--cache-size', type=int, default=1024)
+    args = parser.parse_args()
+    server = QueryServer(args.filename, args.workers, args.max_pending, args.cache_size)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
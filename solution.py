@@ -1,18 +1,142 @@
 from a_star import AStar
 from a_star_changes import AStarChanges
-from dijkstra import Dijkstra
+from dijkstra import Dijkstra, print_itinerary
+from csa import ConnectionScan
+from raptor import Raptor
 import sys
-from tools import Stop
-from typing import Tuple
+import math
+import multiprocessing as mp
+from functools import partial
+from tools import Stop, Route, LRUCache, time_to_minutes
+from timetable import Timetable
+from stop_index import NameIndex, GridIndex
+from typing import Tuple, List, Dict, Iterable, Iterator, Union
+import time as tm
+
+# criteria whose cost is the travel time, the others count transfers
+time_criteria = ('d', 't', 'c')
+
+# a (latitude, longitude) point is left and reached on foot through the stops around it
+walking_speed_kmh = 5
+walking_radius_km = 0.8
+
+def describe(point: Union[str, Tuple[float, float]]) -> str:
+    return point if isinstance(point, str) else f"({point[0]:.6f}, {point[1]:.6f})"
+
+def point_stop(point: Union[str, Tuple[float, float]]) -> Stop:
+    # the stop the hooks of the engines are given for a name or a point
+    return Stop(point,0,0) if isinstance(point, str) else Stop(describe(point), *point)
+
+# solution used by the pool workers, inherited from the parent when forking
+_worker_solution: "Solution" = None
+
+def _init_worker(filename: str) -> None:
+    # without fork every worker loads its own solution, which is cheap with the graph cache
+    global _worker_solution
+    _worker_solution = Solution(filename)
+
+def _find_records(task: Tuple[str, List[str]], start_time: str, criteria: str) -> List[Tuple[str, str, int, float]]:
+    return _worker_solution._find_records(task, start_time, criteria)
 
 class Solution:
     
-    def __init__(self) -> None:
-        self.dijkstra = Dijkstra()
-        self.a_star = AStar()
-        self.a_star_changes = AStarChanges()
+    def __init__(self, filename="connection_graph (1).csv", cache_size: int = 1024) -> None:
+        # the timetable is loaded once and shared by all the engines
+        self.filename = filename
+        self.graph = Timetable.load(filename)
+        self.dijkstra = Dijkstra(self.graph)
+        self.a_star = AStar(self.graph)
+        self.a_star_changes = AStarChanges(self.graph)
+        self.connection_scan = ConnectionScan(self.graph)
+        self.raptor = Raptor(self.graph)
+        # results of find by (criteria, start, end, next departure from the start), for the graph version they were found on
+        self.cache = LRUCache(cache_size)
+        self.cache_version = self.graph.version
+        # stops by their names regardless of case and diacritics, and by their coordinates
+        self.names = NameIndex(self.graph.stops)
+        self.grid = GridIndex(self.graph.latitudes, self.graph.longitudes)
+        # the indexes follow the stops added by timetable updates, the cache is cleared by the version
+        self.graph.subscribe(self._graph_changed)
+
+    def _graph_changed(self, structural: bool) -> None:
+        if structural:
+            self.names = NameIndex(self.graph.stops)
+            self.grid = GridIndex(self.graph.latitudes, self.graph.longitudes)
+
+    def resolve(self, name: str) -> str:
+        # the stop name itself, or the best match of the name index
+        if Stop(name,0,0) in self.graph.stop_ids:
+            return name
+        matches = self.names.lookup(name, 1)
+        return self.graph.stops[matches[0]].name if matches else name
+
+    def access(self, point: Union[str, Tuple[float, float]]) -> List[Tuple[int, int]]:
+        # (stop id, walking minutes) of the stops a name or a point is left or reached from
+        if isinstance(point, str):
+            return [(self.graph.stop_ids[Stop(self.resolve(point),0,0)], 0)]
+        latitude, longitude = point
+        # the nearest stop when there is none within the walking radius
+        stops = self.grid.within(latitude, longitude, walking_radius_km) or self.grid.nearest(latitude, longitude)
+        return [(stop, math.ceil(60 * km / walking_speed_kmh)) for stop, km in stops]
     
-    def find(self, a_start: str, b_end: str, start_time: str, criteria: str, debug: bool = True) -> Tuple[int, float]:
+    def find(self, a_start: Union[str, Tuple[float, float]], b_end: Union[str, Tuple[float, float]], start_time: str, criteria: str, debug: bool = True) -> Tuple[int, float]:
+        # stops are names, resolved by the name index when there is no such stop, or (latitude, longitude) points
+        if not isinstance(a_start, str) or not isinstance(b_end, str):
+            if criteria == 'd':
+                return self.find_walking(a_start, b_end, start_time, debug)
+            # the other criteria go from and to the nearest stops, without the walking
+            a_start, b_end = [point if isinstance(point, str) else self.graph.stops[self.grid.nearest(*point)[0][0]].name for point in (a_start, b_end)]
+        a_start, b_end = self.resolve(a_start), self.resolve(b_end)
+        # printed routes are not cached, debug runs always search
+        if debug or criteria not in ('d', 't', 'p', 'c', 'r'):
+            return self._find(a_start, b_end, start_time, criteria, debug)
+        if self.cache_version != self.graph.version:
+            self.cache.clear()
+            self.cache_version = self.graph.version
+        begin = tm.time()
+        time = time_to_minutes(start_time)
+        # until the next departure from the start every search boards the same connections,
+        # the arrival and the transfers stay the same, only the waiting at the start changes
+        departure = self.graph.next_departure(self.graph.stop_ids[Stop(a_start,0,0)], time)
+        key = criteria, a_start, b_end, departure
+        value = self.cache.get(key)
+        if value is not None:
+            return (value - time if criteria in time_criteria else value), tm.time() - begin
+        cost, elapsed = self._find(a_start, b_end, start_time, criteria, debug)
+        if cost is not None:
+            self.cache.put(key, cost + time if criteria in time_criteria else cost)
+        return cost, elapsed
+
+    def find_walking(self, a_start: Union[str, Tuple[float, float]], b_end: Union[str, Tuple[float, float]], start_time: str, debug: bool = True) -> Tuple[int, float]:
+        # earliest arrival walking to any stop around the start and from any stop around the end, in one Dijkstra search
+        begin = tm.time()
+        time = time_to_minutes(start_time)
+        graph = self.graph
+        sources = self.access(a_start)
+        targets = self.access(b_end)
+        dijkstra = self.dijkstra
+        with dijkstra._query(point_stop(a_start), point_stop(b_end), start_time):
+            with dijkstra._phase("proceeding"):
+                dijkstra._search([(stop, time + walk) for stop, walk in sources])
+        labels = dijkstra.labels
+        for stop, _ in targets:
+            labels.touch(stop)
+        end, walk = min(targets, key=lambda target: labels.min_arrival_minutes[target[0]] + target[1])
+        cost = labels.min_arrival_minutes[end] + walk - time if labels.min_arrival_minutes[end] < 1e10 else None
+        elapsed = tm.time() - begin
+        if debug:
+            route = self.dijkstra._itinerary(end)
+            start = graph.stop_ids[route[0][0]] if route else end
+            print(f"From {describe(a_start)} at {start_time}:")
+            if dict(sources).get(start, 0) > 0:
+                print(f"Walk {dict(sources)[start]} min to {graph.stops[start].name}")
+            print_itinerary(route)
+            if walk > 0:
+                print(f"Walk {walk} min from {graph.stops[end].name} to {describe(b_end)}")
+            print(f'Cost function: {cost}', file=sys.stderr)
+        return cost, elapsed
+
+    def _find(self, a_start: str, b_end: str, start_time: str, criteria: str, debug: bool) -> Tuple[int, float]:
         a = Stop(a_start,0,0)
         b = Stop(b_end,0,0)
         if criteria == 'd':
@@ -21,7 +145,55 @@ class Solution:
             return self.a_star.run(a,b,start_time, debug=debug)
         elif criteria == 'p':
             return self.a_star_changes.run(a,b,start_time, debug=debug)
+        elif criteria == 'c':
+            return self.connection_scan.run(a,b,start_time, debug=debug)
+        elif criteria == 'r':
+            return self.raptor.run(a,b,start_time, debug=debug)
         else:
-            print("Wrong criteria! It must be 't' or 'p'",file=sys.stderr)
+            print("Wrong criteria! It must be 'd', 't', 'p', 'c' or 'r'",file=sys.stderr)
             return None, None
-        
\ No newline at end of file
+        
+    def find_all(self, a_start: str, start_time: str) -> Dict[Stop, Tuple[int, List[Tuple[Stop, Route, Stop, int]]]]:
+        # costs and itineraries to every reachable stop from a single Dijkstra search
+        return self.dijkstra.run_all(Stop(self.resolve(a_start),0,0), start_time)
+
+    def find_many(self, pairs: Iterable[Tuple[str, str]], start_time: str, criteria: str, workers: int = None, chunksize: int = 16, group_origins: bool = False) -> Iterator[Tuple[str, str, int, float]]:
+        # yields (start, end, cost, elapsed) records as soon as they are ready, not in the order of pairs;
+        # the cost is None for an end that cannot be reached, whatever the criteria;
+        # group_origins answers all the pairs sharing an origin with a single search ('d' only)
+        if group_origins:
+            origins: Dict[str, List[str]] = {}
+            for a_start, b_end in pairs:
+                origins.setdefault(a_start, []).append(b_end)
+            tasks = origins.items()
+        else:
+            tasks = ((a_start, [b_end]) for a_start, b_end in pairs)
+        if workers == 1:
+            for task in tasks:
+                yield from self._find_records(task, start_time, criteria)
+            return
+        global _worker_solution
+        if 'fork' in mp.get_all_start_methods():
+            # forked workers share the already built graph copy-on-write
+            _worker_solution = self
+            pool = mp.get_context('fork').Pool(workers)
+        else:
+            pool = mp.get_context('spawn').Pool(workers, initializer=_init_worker, initargs=(self.filename,))
+        with pool:
+            for records in pool.imap_unordered(partial(_find_records, start_time=start_time, criteria=criteria), tasks, chunksize):
+                yield from records
+
+    def _find_records(self, task: Tuple[str, List[str]], start_time: str, criteria: str) -> List[Tuple[str, str, int, float]]:
+        a_start, ends = task
+        if criteria == 'd' and len(ends) > 1:
+            # one search for all the destinations, its time is split evenly between them
+            a = Stop(self.resolve(a_start),0,0)
+            begin = tm.time()
+            self.dijkstra.run_all(a, start_time, itineraries=False)
+            elapsed = (tm.time() - begin) / len(ends)
+            return [(a_start, b_end, self.dijkstra._cost(a, Stop(self.resolve(b_end),0,0), start_time), elapsed) for b_end in ends]
+        records = []
+        for b_end in ends:
+            cost, elapsed = self.find(a_start, b_end, start_time, criteria, debug=False)
+            records.append((a_start, b_end, cost, elapsed))
+        return records
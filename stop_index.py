@@ -0,0 +1,115 @@
+from typing import List, Dict, Tuple
+from bisect import bisect_left
+import difflib
+import math
+import re
+import unicodedata
+import numpy as np
+from tools import Stop, haversine_km
+
+# letters the unicode decomposition leaves as they are
+special_letters = str.maketrans({'ł': 'l', 'Ł': 'l', 'đ': 'd', 'ß': 'ss'})
+
+def normalize(name: str) -> str:
+    # lower case without diacritics and punctuation, "Plac  Grunwaldzki." and "plac grunwaldzki" are the same
+    name = unicodedata.normalize('NFKD', str(name).translate(special_letters))
+    name = ''.join(char for char in name if not unicodedata.combining(char)).lower()
+    return ' '.join(re.split(r'[\W_]+', name)).strip()
+
+class NameIndex:
+    # normalized names of the stops, for exact, prefix (of the name or of any of its words) and fuzzy lookups
+    def __init__(self, stops: List[Stop]) -> None:
+        self.exact: Dict[str, List[int]] = {}
+        for i, stop in enumerate(stops):
+            self.exact.setdefault(normalize(stop.name), []).append(i)
+        self.names = sorted(self.exact.keys())
+        # the names from every later word on, for "grunwaldzki" finding "Plac Grunwaldzki"
+        self.words = sorted((' '.join(name.split()[i:]), name) for name in self.names for i in range(1, len(name.split())))
+
+    def lookup(self, query: str, limit: int = 10) -> List[int]:
+        # stop ids, the best matches first
+        key = normalize(query)
+        if not key:
+            return []
+        names = [key] if key in self.exact else []
+        # names starting with the query, then names with a later word starting with it
+        i = bisect_left(self.names, key)
+        while i < len(self.names) and self.names[i].startswith(key) and len(names) < limit:
+            if self.names[i] not in names:
+                names.append(self.names[i])
+            i += 1
+        i = bisect_left(self.words, (key, ''))
+        while i < len(self.words) and self.words[i][0].startswith(key) and len(names) < limit:
+            if self.words[i][1] not in names:
+                names.append(self.words[i][1])
+            i += 1
+        if not names:
+            # misspelled, the most similar names
+            names = difflib.get_close_matches(key, self.names, n=limit, cutoff=0.6)
+        return [stop for name in names for stop in self.exact[name]][:limit]
+
+class GridIndex:
+    # stops bucketed into square cells of about cell_km, for nearest and radius queries
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray, cell_km: float = 0.5) -> None:
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.cell_km = cell_km
+        self.cell_latitude = cell_km / 111.2
+        middle = float(np.mean(self.latitudes)) if len(self.latitudes) else 0
+        self.cell_longitude = cell_km / (111.2 * max(math.cos(math.radians(middle)), 0.01))
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        for stop, cell in enumerate(zip((self.latitudes // self.cell_latitude).astype(int).tolist(), (self.longitudes // self.cell_longitude).astype(int).tolist())):
+            self.cells.setdefault(cell, []).append(stop)
+        rows = [cell[0] for cell in self.cells] or [0]
+        columns = [cell[1] for cell in self.cells] or [0]
+        self.bounds = min(rows), max(rows), min(columns), max(columns)
+
+    def _ring(self, row: int, column: int, radius: int) -> List[int]:
+        # stops of the cells exactly radius cells away (in the max norm)
+        if radius == 0:
+            return list(self.cells.get((row, column), []))
+        stops = []
+        for i in range(-radius, radius+1):
+            for cell in ((row+i, column-radius), (row+i, column+radius)):
+                stops.extend(self.cells.get(cell, []))
+        for j in range(-radius+1, radius):
+            for cell in ((row-radius, column+j), (row+radius, column+j)):
+                stops.extend(self.cells.get(cell, []))
+        return stops
+
+    def _distances(self, stops: List[int], latitude: float, longitude: float) -> List[Tuple[int, float]]:
+        distances = haversine_km(self.latitudes[stops], self.longitudes[stops], latitude, longitude).tolist() if stops else []
+        return list(zip(stops, distances))
+
+    def _all(self, latitude: float, longitude: float, k: int) -> List[Tuple[int, float]]:
+        # every stop at once, for points the rings would take long to reach from
+        distances = haversine_km(self.latitudes, self.longitudes, latitude, longitude)
+        stops = np.argsort(distances, kind='stable')[:k].tolist()
+        return list(zip(stops, distances[stops].tolist()))
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1) -> List[Tuple[int, float]]:
+        # (stop id, km) of the k nearest stops, nearest first
+        row, column = int(latitude // self.cell_latitude), int(longitude // self.cell_longitude)
+        if not (self.bounds[0] <= row <= self.bounds[1] and self.bounds[2] <= column <= self.bounds[3]):
+            return self._all(latitude, longitude, k)
+        # no stops beyond this ring
+        last = max(abs(row - self.bounds[0]), abs(row - self.bounds[1]), abs(column - self.bounds[2]), abs(column - self.bounds[3]))
+        found: List[Tuple[int, float]] = []
+        for radius in range(last + 1):
+            # more cells in the rings than occupied ones, a pass over all the stops is cheaper
+            if (2*radius + 1)**2 > 4 * len(self.cells):
+                return self._all(latitude, longitude, k)
+            found.extend(self._distances(self._ring(row, column, radius), latitude, longitude))
+            found.sort(key=lambda entry: entry[1])
+            # stops in further rings are at least radius cells away
+            if len(found) >= k and found[k-1][1] <= radius * self.cell_km:
+                break
+        return found[:k]
+
+    def within(self, latitude: float, longitude: float, radius_km: float) -> List[Tuple[int, float]]:
+        # (stop id, km) of the stops in the radius, nearest first
+        row, column = int(latitude // self.cell_latitude), int(longitude // self.cell_longitude)
+        if (2*(radius_km // self.cell_km) + 3)**2 > 4 * len(self.cells):
+            return [entry for entry in self._all(latitude, longitude, len(self.latitudes)) if entry[1] <= radius_km]
+        stops = [stop for radius in range(int(radius_km // self.cell_km) + 2) for stop in self._ring(row, column, radius)]
+        return sorted([entry for entry in self._distances(stops, latitude, longitude) if entry[1] <= radius_km], key=lambda entry: entry[1])
@@ -0,0 +1,555 @@
+from typing import List, Dict, Tuple, Set, Callable, Union, Iterator
+from bisect import bisect_left
+from contextlib import contextmanager
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time as tm
+import weakref
+import numpy as np
+import pandas as pd
+from tools import Stop, Route, SearchStats, time_to_minutes, format_time, change_minutes
+
+day_minutes = 24*60
+# departure of a removed connection, sorted after all the others of its edge and never boarded
+tombstone = int(np.iinfo(np.int16).max)
+# bump whenever the layout of the arrays changes, so old caches get rebuilt
+cache_version = 2
+# rows read at once by the streaming ingestion
+chunk_rows = 100_000
+# columns read as text in every chunk, so a chunk of numbers only does not change their type
+text_columns = {'line': str, 'departure_time': str, 'arrival_time': str, 'start_stop': str, 'end_stop': str}
+
+def file_digest(filename: str) -> str:
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def parse_times(times: pd.Series) -> np.ndarray:
+    # there are only a few thousand distinct times, so parse each of them once
+    codes, uniques = pd.factorize(times)
+    minutes = np.array([time_to_minutes(time) for time in uniques], dtype=np.int16)
+    return minutes[codes]
+
+class Timetable:
+    # stops and lines are numbered by their first appearance in the data;
+    # connections are kept in CSR layout: stop -> edges (stop pairs) -> connections sorted by departure,
+    # plus a second layout grouping the connections of every edge by line
+    array_names = ('latitudes', 'longitudes', 'edge_offsets', 'edge_targets', 'conn_offsets', 'departures', 'arrivals',
+                   'conn_lines', 'group_offsets', 'group_lines', 'group_conn_offsets', 'group_conns', 'group_departures',
+                   'arrival_conns', 'group_arrival_conns')
+
+    def __init__(self, stops: List[Stop], lines: List[object], arrays: Dict[str, np.ndarray]) -> None:
+        # bumped on every change of the connections, results computed on an older version are stale
+        self.version = 0
+        # stats of the query running on the timetable, the lookups are counted when set
+        self.stats: SearchStats = None
+        # rows, unique rows, seconds and rows per second of from_csv
+        self.ingestion: Dict[str, float] = None
+        # callbacks told about the changes, held weakly so engines can be dropped
+        self.subscribers: List[weakref.WeakMethod] = []
+        # changes collected until the end of a batch
+        self.batches = 0
+        self.dirty_edges: Set[int] = set()
+        self.additions: List[Tuple[object, Stop, Stop, int, int]] = []
+        self._set_arrays(stops, lines, arrays)
+
+    def _set_arrays(self, stops: List[Stop], lines: List[object], arrays: Dict[str, np.ndarray]) -> None:
+        self.stops = stops
+        self.lines = lines
+        self.stop_ids: Dict[Stop, int] = {stop: i for i, stop in enumerate(stops)}
+        self.line_ids: Dict[object, int] = {line: i for i, line in enumerate(lines)}
+        # removed connections waiting in their edges, lookups skip them only when there are any
+        self.tombstones = int(np.count_nonzero(arrays['departures'] == tombstone))
+        self.latitudes: np.ndarray = arrays['latitudes']
+        self.longitudes: np.ndarray = arrays['longitudes']
+        # edges of stop v are edge_offsets[v]..edge_offsets[v+1]
+        self.edge_offsets: np.ndarray = arrays['edge_offsets']
+        self.edge_targets: np.ndarray = arrays['edge_targets']
+        # connections of edge e are conn_offsets[e]..conn_offsets[e+1], sorted by departure
+        self.conn_offsets: np.ndarray = arrays['conn_offsets']
+        self.departures: np.ndarray = arrays['departures']
+        self.arrivals: np.ndarray = arrays['arrivals']
+        self.conn_lines: np.ndarray = arrays['conn_lines']
+        # the connection arriving first of the ones leaving at or after connection i of its edge, a later trip may overtake
+        self.arrival_conns: np.ndarray = arrays['arrival_conns']
+        # line groups of edge e are group_offsets[e]..group_offsets[e+1], sorted by line,
+        # connections of group g are group_conns[group_conn_offsets[g]..group_conn_offsets[g+1]], sorted by departure
+        self.group_offsets: np.ndarray = arrays['group_offsets']
+        self.group_lines: np.ndarray = arrays['group_lines']
+        self.group_conn_offsets: np.ndarray = arrays['group_conn_offsets']
+        self.group_conns: np.ndarray = arrays['group_conns']
+        self.group_departures: np.ndarray = arrays['group_departures']
+        # the same for the connections of a group, by their positions in group_conns
+        self.group_arrival_conns: np.ndarray = arrays['group_arrival_conns']
+
+    @staticmethod
+    def from_csv(filenames: List[str], chunk_size: int = chunk_rows, verbose: bool = False) -> "Timetable":
+        # the timetable of the files concatenated, streamed chunk by chunk:
+        # every chunk is reduced to integer columns and a 64-bit hash of the row, so the peak memory
+        # is one chunk plus those columns, and the duplicates are dropped by the hashes at the end
+        begin = tm.perf_counter()
+        stop_ids: Dict[str, int] = {}
+        line_ids: Dict[str, int] = {}
+        latitudes: List[float] = []
+        longitudes: List[float] = []
+        columns: Dict[str, List[np.ndarray]] = {'start': [], 'end': [], 'line': [], 'departure': [], 'arrival': [], 'hash': []}
+        rows = 0
+        for filename in filenames:
+            for chunk in pd.read_csv(filename, chunksize=chunk_size, dtype=text_columns):
+                chunk = chunk.drop(columns='Unnamed: 0', errors='ignore')
+                rows += len(chunk)
+                columns['hash'].append(pd.util.hash_pandas_object(chunk, index=False).to_numpy())
+                # stops numbered by their first appearance over all the chunks, start and end interleaved
+                names = np.column_stack([chunk['start_stop'].to_numpy(), chunk['end_stop'].to_numpy()]).ravel()
+                chunk_latitudes = np.column_stack([chunk['start_stop_lat'].to_numpy(), chunk['end_stop_lat'].to_numpy()]).ravel()
+                chunk_longitudes = np.column_stack([chunk['start_stop_lon'].to_numpy(), chunk['end_stop_lon'].to_numpy()]).ravel()
+                codes, uniques = pd.factorize(names)
+                firsts = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy())
+                ids = np.empty(len(uniques), dtype=np.int32)
+                for i, (name, first) in enumerate(zip(uniques, firsts.tolist())):
+                    if name not in stop_ids:
+                        stop_ids[name] = len(stop_ids)
+                        latitudes.append(float(chunk_latitudes[first]))
+                        longitudes.append(float(chunk_longitudes[first]))
+                    ids[i] = stop_ids[name]
+                stop_codes = ids[codes]
+                columns['start'].append(stop_codes[0::2])
+                columns['end'].append(stop_codes[1::2])
+                codes, uniques = pd.factorize(chunk['line'])
+                columns['line'].append(np.array([line_ids.setdefault(line, len(line_ids)) for line in uniques], dtype=np.int32)[codes])
+                columns['departure'].append(parse_times(chunk['departure_time']))
+                columns['arrival'].append(parse_times(chunk['arrival_time']))
+        columns = {name: np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int16) for name, arrays in columns.items()}
+        # the first of the rows with the same hash, as drop_duplicates keeps
+        unique = ~pd.Series(columns.pop('hash')).duplicated().to_numpy()
+        columns = {name: column[unique] for name, column in columns.items()}
+        lines: List[object] = list(line_ids.keys())
+        try:
+            # numbers when all the lines are, as read_csv gives for a whole file
+            lines = pd.to_numeric(pd.Series(lines, dtype=object)).tolist()
+        except ValueError:
+            pass
+        arrays = Timetable.build_arrays(len(stop_ids), columns['start'], columns['end'], columns['line'], columns['departure'], columns['arrival'])
+        arrays['latitudes'] = np.array(latitudes, dtype=np.float64)
+        arrays['longitudes'] = np.array(longitudes, dtype=np.float64)
+        stops = [Stop(name, lat, lon) for name, lat, lon in zip(stop_ids.keys(), latitudes, longitudes)]
+        timetable = Timetable(stops, lines, arrays)
+        seconds = tm.perf_counter() - begin
+        timetable.ingestion = {'files': len(filenames), 'rows': rows, 'unique_rows': int(unique.sum()), 'seconds': seconds,
+                               'rows_per_second': rows / seconds if seconds > 0 else None}
+        if verbose:
+            print(f"Read {rows} rows ({timetable.ingestion['unique_rows']} unique) of {len(filenames)} files in {seconds:.2f} s, "
+                  f"{rows / max(seconds, 1e-9):.0f} rows/s", file=sys.stderr)
+        return timetable
+
+    @staticmethod
+    def build_arrays(n_stops: int, start: np.ndarray, end: np.ndarray, line_codes: np.ndarray, departures: np.ndarray, arrivals: np.ndarray) -> Dict[str, np.ndarray]:
+        # the connection layouts of rows given by stop and line ids
+        start = start.astype(np.int64)
+        end = end.astype(np.int64)
+        line_codes = line_codes.astype(np.int64)
+        # edges are numbered by their first appearance as well
+        edge_codes = pd.factorize(start * n_stops + end)[0]
+
+        order = np.lexsort((arrivals, departures, edge_codes, start))
+        sorted_edges = edge_codes[order]
+        new_edge = np.ones(len(order), dtype=bool)
+        new_edge[1:] = sorted_edges[1:] != sorted_edges[:-1]
+        edge_starts = np.flatnonzero(new_edge)
+        edge_sources = start[order][edge_starts]
+        conn_edges = np.cumsum(new_edge) - 1
+
+        # position of every row in the departure-sorted layout
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = np.arange(len(order))
+        group_order = np.lexsort((arrivals, departures, line_codes, edge_codes, start))
+        sorted_edges = edge_codes[group_order]
+        sorted_lines = line_codes[group_order]
+        new_group = np.ones(len(group_order), dtype=bool)
+        new_group[1:] = (sorted_edges[1:] != sorted_edges[:-1]) | (sorted_lines[1:] != sorted_lines[:-1])
+        group_starts = np.flatnonzero(new_group)
+        group_conns = positions[group_order]
+        group_edges = conn_edges[group_conns[group_starts]]
+        sorted_departures, sorted_arrivals = departures[order], arrivals[order]
+
+        return {
+            'edge_offsets': np.searchsorted(edge_sources, np.arange(n_stops+1)).astype(np.int64),
+            'edge_targets': end[order][edge_starts].astype(np.int32),
+            'conn_offsets': np.append(edge_starts, len(order)).astype(np.int64),
+            'departures': departures[order],
+            'arrivals': arrivals[order],
+            'conn_lines': line_codes[order].astype(np.int32),
+            'group_offsets': np.searchsorted(group_edges, np.arange(len(edge_starts)+1)).astype(np.int64),
+            'group_lines': line_codes[group_order][group_starts].astype(np.int32),
+            'group_conn_offsets': np.append(group_starts, len(group_order)).astype(np.int64),
+            'group_conns': group_conns.astype(np.int32),
+            'group_departures': departures[group_order],
+            'arrival_conns': earliest_arrivals(sorted_departures, sorted_arrivals, np.diff(np.append(edge_starts, len(order)))).astype(np.int32),
+            'group_arrival_conns': group_conns[earliest_arrivals(sorted_departures[group_conns], sorted_arrivals[group_conns],
+                                                                 np.diff(np.append(group_starts, len(group_order))))].astype(np.int32),
+        }
+
+    @staticmethod
+    def load(filename: Union[str, List[str]], cache: bool = True) -> "Timetable":
+        # the arrays are cached in a directory next to the csv and memory-mapped on later loads;
+        # several csv files (of a region, say) are streamed together without a cache
+        if not isinstance(filename, str):
+            return Timetable.from_csv(filename)
+        if not cache:
+            return Timetable.from_csv([filename])
+        cache_dir = filename + '.cache'
+        timetable = Timetable._read_cache(filename, cache_dir)
+        if timetable is None:
+            timetable = Timetable.from_csv([filename])
+            try:
+                timetable._write_cache(filename, cache_dir)
+            except OSError as e:
+                print(f"Could not write the graph cache {cache_dir}: {e}", file=sys.stderr)
+        return timetable
+
+    @staticmethod
+    def _read_cache(filename: str, cache_dir: str) -> "Timetable":
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        if not os.path.isfile(meta_path):
+            return None
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['version'] != cache_version:
+            return None
+        stat = os.stat(filename)
+        if meta['size'] != stat.st_size:
+            return None
+        if meta['mtime_ns'] != stat.st_mtime_ns:
+            # touched but possibly unchanged, compare the contents
+            if meta['sha1'] != file_digest(filename):
+                return None
+            meta['mtime_ns'] = stat.st_mtime_ns
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+        # plain ndarray views of the maps, indexing np.memmap itself is much slower;
+        # copy-on-write, so updates change the pages of this process only
+        arrays = {name: np.asarray(np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='c')) for name in Timetable.array_names}
+        stops = [Stop(name, lat, lon) for name, lat, lon in zip(meta['stops'], arrays['latitudes'].tolist(), arrays['longitudes'].tolist())]
+        return Timetable(stops, meta['lines'], arrays)
+
+    def _write_cache(self, filename: str, cache_dir: str) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, 'meta.json')
+        # the metadata is written last, a cache without it is never read
+        if os.path.isfile(meta_path):
+            os.remove(meta_path)
+        for name in Timetable.array_names:
+            np.save(os.path.join(cache_dir, name + '.npy'), getattr(self, name))
+        stat = os.stat(filename)
+        meta = {
+            'version': cache_version,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha1': file_digest(filename),
+            'stops': [stop.name for stop in self.stops],
+            'lines': [line.item() if isinstance(line, np.generic) else line for line in self.lines],
+        }
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    def connection_stops(self) -> Tuple[np.ndarray, np.ndarray]:
+        # start and end stop of every connection
+        conn_edges = np.repeat(np.arange(len(self.edge_targets)), np.diff(self.conn_offsets))
+        edge_sources = np.repeat(np.arange(len(self.stops)), np.diff(self.edge_offsets))
+        return edge_sources[conn_edges].astype(np.int32), self.edge_targets[conn_edges]
+
+    def edge_durations(self) -> np.ndarray:
+        # shortest ride of every edge in minutes, through midnight included
+        durations = (self.arrivals.astype(np.int64) - self.departures) % day_minutes
+        # removed connections are never ridden
+        durations[self.departures == tombstone] = tombstone
+        if len(self.edge_targets) == 0:
+            return durations
+        return np.minimum.reduceat(durations, self.conn_offsets[:-1])
+
+    def route(self, conn: int) -> Route:
+        return Route(line=self.lines[self.conn_lines[conn]], departure_minutes=int(self.departures[conn]), arrival_minutes=int(self.arrivals[conn]))
+
+    def arrival_after(self, edge: int, time: int, last_line: int) -> Tuple[int, int]:
+        # earliest arrival through the edge for somebody waiting at its start since the (absolute) time,
+        # found from the first departure after it
+        first, last = self.conn_offsets[edge], self.conn_offsets[edge+1]
+        # normalize arrival time to 24h
+        time_modulo = time % day_minutes
+        # take time for a change of line
+        chosen = bisect_left(self.departures, time_modulo + change_minutes, first, last)
+        if self.stats is not None:
+            self.stats.lookups += 1
+            self.stats.lookup_steps += int(last - first).bit_length()
+        if self.tombstones > 0:
+            # removed connections close the edge, every one of them removed closes it for good
+            if self.departures[first] == tombstone:
+                return 1e10, None
+            if chosen < last and self.departures[chosen] == tombstone:
+                chosen = last
+        if change_minutes > 0 and last_line is not None:
+            # staying on the same line needs no time for a change
+            group = self.line_group(edge, last_line)
+            if group is not None:
+                group_first, group_last = self.group_conn_offsets[group], self.group_conn_offsets[group+1]
+                same = bisect_left(self.group_departures, time_modulo, group_first, group_last)
+                if self.stats is not None:
+                    self.stats.lookup_steps += int(group_last - group_first).bit_length()
+                if same < group_last and self.group_departures[same] != tombstone:
+                    same = int(self.group_arrival_conns[same])
+                    if chosen == last or self._ride_end(same) < self._ride_end(int(self.arrival_conns[chosen])):
+                        return self._arrival(same, self.arrival_conns, first, time)
+        # if there are no more this day, take the first arrival after midnight
+        return self._arrival(int(self.arrival_conns[chosen]) if chosen < last else None, self.arrival_conns, first, time)
+
+    def next_departure(self, stop: int, time: int) -> int:
+        # earliest (absolute) departure from the stop for somebody starting there at the time, None without any;
+        # every search started before it boards the same connections as one started right at it
+        time_modulo = time % day_minutes
+        day = time - time_modulo
+        departure = None
+        for edge in range(self.edge_offsets[stop], self.edge_offsets[stop+1]):
+            first, last = self.conn_offsets[edge], self.conn_offsets[edge+1]
+            chosen = bisect_left(self.departures, time_modulo + change_minutes, first, last)
+            if self.tombstones > 0:
+                if self.departures[first] == tombstone:
+                    continue
+                if chosen < last and self.departures[chosen] == tombstone:
+                    chosen = last
+            # if there are no more this day, take the first one after midnight
+            edge_departure = day + int(self.departures[chosen]) if chosen < last else day + day_minutes + int(self.departures[first])
+            if departure is None or edge_departure < departure:
+                departure = edge_departure
+        return departure
+
+    def line_arrival_after(self, group: int, time: int, last_line: int) -> Tuple[int, int]:
+        # same as arrival_after, restricted to a single line of an edge
+        first, last = self.group_conn_offsets[group], self.group_conn_offsets[group+1]
+        time_modulo = time % day_minutes
+        change_fine = 0 if self.group_lines[group] == last_line else change_minutes
+        same = bisect_left(self.group_departures, time_modulo + change_fine, first, last)
+        if self.stats is not None:
+            self.stats.lookups += 1
+            self.stats.lookup_steps += int(last - first).bit_length()
+        if self.tombstones > 0:
+            if self.group_departures[first] == tombstone:
+                return 1e10, None
+            if same < last and self.group_departures[same] == tombstone:
+                same = last
+        return self._arrival(int(self.group_arrival_conns[same]) if same < last else None, self.group_arrival_conns, first, time)
+
+    def line_group(self, edge: int, line: int) -> int:
+        first, last = self.group_offsets[edge], self.group_offsets[edge+1]
+        group = bisect_left(self.group_lines, line, first, last)
+        return group if group < last and self.group_lines[group] == line else None
+
+    def _arrival(self, chosen: int, arrival_conns: np.ndarray, first: int, time: int) -> Tuple[int, int]:
+        # chosen arrives first of the connections left this day, None without any;
+        # arrival_conns[first] arrives first of all of them, taken the next day
+        # derive real cost including days already travelled (anti-prior-normalization)
+        day = (time // day_minutes) * day_minutes
+        if chosen is not None:
+            arrival = int(self.arrivals[chosen])
+            if arrival >= self.departures[chosen]:
+                return day + arrival, chosen
+            # derive real cost adding day if you were on a road during midnight,
+            # the first connection of the next day may still arrive before
+            earliest = int(arrival_conns[first])
+            if arrival <= self._ride_end(earliest):
+                return day + day_minutes + arrival, chosen
+        else:
+            earliest = int(arrival_conns[first])
+        return day + day_minutes + self._ride_end(earliest), earliest
+
+    def _ride_end(self, conn: int) -> int:
+        # arrival in minutes from the midnight before the departure, adding a day if you were on a road during midnight
+        arrival = int(self.arrivals[conn])
+        return arrival if arrival >= self.departures[conn] else arrival + day_minutes
+
+    def subscribe(self, callback: Callable[[bool], None]) -> None:
+        # callback(structural) after every committed change; structural when stops, edges or lines were added
+        self.subscribers.append(weakref.WeakMethod(callback))
+
+    def find_connection(self, line: object, start: Union[Stop, str], end: Union[Stop, str], departure: Union[str, int]) -> int:
+        # position of the connection of the line between the stops leaving at the departure
+        group = self._group(line, start, end)
+        if group is None:
+            raise KeyError(f"no line {line!r} from {stop_name(start)} to {stop_name(end)}")
+        first, last = self.group_conn_offsets[group], self.group_conn_offsets[group+1]
+        departure = update_minutes(departure)
+        same = bisect_left(self.group_departures, departure, first, last)
+        if same == last or self.group_departures[same] != departure or self.departures[self.group_conns[same]] == tombstone:
+            raise KeyError(f"no departure of line {line!r} from {stop_name(start)} to {stop_name(end)} at {format_time(departure)}")
+        return int(self.group_conns[same])
+
+    def shift_connection(self, line: object, start: Union[Stop, str], end: Union[Stop, str], departure: Union[str, int], minutes: int, arrival_minutes: int = None) -> None:
+        # delays (or brings forward) the connection, the arrival by the same minutes unless given separately
+        conn = self.find_connection(line, start, end, departure)
+        arrival_minutes = minutes if arrival_minutes is None else arrival_minutes
+        self.departures[conn] = (int(self.departures[conn]) + minutes) % day_minutes
+        self.arrivals[conn] = (int(self.arrivals[conn]) + arrival_minutes) % day_minutes
+        self._changed(conn)
+
+    def remove_connection(self, line: object, start: Union[Stop, str], end: Union[Stop, str], departure: Union[str, int]) -> None:
+        # cancels the connection, its place stays in the arrays until a structural change rebuilds them
+        conn = self.find_connection(line, start, end, departure)
+        self.departures[conn] = tombstone
+        self._changed(conn)
+
+    def add_connection(self, line: object, start: Union[Stop, str], end: Union[Stop, str], departure: Union[str, int], arrival: Union[str, int],
+                       start_location: Tuple[float, float] = None, end_location: Tuple[float, float] = None) -> None:
+        # a connection of a line already riding between the stops takes the place of a removed one if there is any,
+        # anything else (a new stop, edge or line) rebuilds the arrays when the batch ends
+        departure, arrival = update_minutes(departure), update_minutes(arrival)
+        group = self._group(line, start, end)
+        if group is not None:
+            # the removed connections are at the end of the group, some may have been taken earlier in the batch
+            spare = int(self.group_conn_offsets[group+1]) - 1
+            while spare >= self.group_conn_offsets[group] and self.group_departures[spare] == tombstone:
+                conn = int(self.group_conns[spare])
+                if self.departures[conn] == tombstone:
+                    self.departures[conn] = departure
+                    self.arrivals[conn] = arrival
+                    self._changed(conn)
+                    return
+                spare -= 1
+        for name, location in ((stop_name(start), start_location), (stop_name(end), end_location)):
+            if Stop(name,0,0) not in self.stop_ids and location is None:
+                raise ValueError(f"new stop {name!r} needs a location")
+        self.additions.append((line, Stop(stop_name(start), *(start_location or (0, 0))), Stop(stop_name(end), *(end_location or (0, 0))), departure, arrival))
+        if self.batches == 0:
+            self._commit()
+
+    @contextmanager
+    def batch(self) -> Iterator["Timetable"]:
+        # changes inside the block are committed together at its end, the timetable must not be searched before;
+        # connections are found by their departures from before the block
+        self.batches += 1
+        try:
+            yield self
+        finally:
+            self.batches -= 1
+            if self.batches == 0:
+                self._commit()
+
+    def _group(self, line: object, start: Union[Stop, str], end: Union[Stop, str]) -> int:
+        start_id = self.stop_ids.get(Stop(stop_name(start),0,0))
+        end_id = self.stop_ids.get(Stop(stop_name(end),0,0))
+        if start_id is None or end_id is None or line not in self.line_ids:
+            return None
+        for edge in range(self.edge_offsets[start_id], self.edge_offsets[start_id+1]):
+            if self.edge_targets[edge] == end_id:
+                return self.line_group(edge, self.line_ids[line])
+        return None
+
+    def _changed(self, conn: int) -> None:
+        self.dirty_edges.add(int(np.searchsorted(self.conn_offsets, conn, 'right')) - 1)
+        if self.batches == 0:
+            self._commit()
+
+    def _commit(self) -> None:
+        if not self.dirty_edges and not self.additions:
+            return
+        structural = len(self.additions) > 0
+        if structural:
+            self._rebuild()
+        else:
+            self._sort_edges(np.array(sorted(self.dirty_edges), dtype=np.int64))
+        self.dirty_edges = set()
+        self.additions = []
+        self.tombstones = int(np.count_nonzero(self.departures == tombstone))
+        self.version += 1
+        for subscriber in list(self.subscribers):
+            callback = subscriber()
+            if callback is None:
+                self.subscribers.remove(subscriber)
+            else:
+                callback(structural)
+
+    def _sort_edges(self, edges: np.ndarray) -> None:
+        # restores the departure order of the changed edges and of their line groups, all the edges at once
+        positions = spans(self.conn_offsets[edges], self.conn_offsets[edges+1])
+        owners = np.repeat(np.arange(len(edges)), np.diff(self.conn_offsets)[edges])
+        # one key (edge, departure, arrival) sorts faster than lexsort over the three
+        keys = (owners << 32) | (self.departures[positions].astype(np.int64) << 16) | self.arrivals[positions].astype(np.int64)
+        moved = positions[np.argsort(keys)]
+        self.departures[positions] = self.departures[moved]
+        self.arrivals[positions] = self.arrivals[moved]
+        self.conn_lines[positions] = self.conn_lines[moved]
+        new_positions = np.arange(len(self.departures))
+        new_positions[moved] = positions
+        # the groups of an edge are consecutive, so are their connections
+        groups = spans(self.group_offsets[edges], self.group_offsets[edges+1])
+        group_positions = spans(self.group_conn_offsets[groups], self.group_conn_offsets[groups+1])
+        conns = new_positions[self.group_conns[group_positions]]
+        conns = conns[np.argsort((np.repeat(groups, np.diff(self.group_conn_offsets)[groups]) << 32) | conns)]
+        self.group_conns[group_positions] = conns
+        self.group_departures[group_positions] = self.departures[conns]
+        self.arrival_conns[positions] = positions[earliest_arrivals(self.departures[positions], self.arrivals[positions], np.diff(self.conn_offsets)[edges])]
+        self.group_arrival_conns[group_positions] = conns[earliest_arrivals(self.departures[conns], self.arrivals[conns], np.diff(self.group_conn_offsets)[groups])]
+
+    def _rebuild(self) -> None:
+        # the live connections plus the added ones, existing stops and lines keep their ids
+        sources, targets = self.connection_stops()
+        live = self.departures != tombstone
+        stops, lines = list(self.stops), list(self.lines)
+        stop_ids, line_ids = dict(self.stop_ids), dict(self.line_ids)
+        start, end, line_codes, departures, arrivals = [], [], [], [], []
+        for line, start_stop, end_stop, departure, arrival in self.additions:
+            for stop in (start_stop, end_stop):
+                if stop not in stop_ids:
+                    stop_ids[stop] = len(stops)
+                    stops.append(stop)
+            if line not in line_ids:
+                line_ids[line] = len(lines)
+                lines.append(line)
+            start.append(stop_ids[start_stop])
+            end.append(stop_ids[end_stop])
+            line_codes.append(line_ids[line])
+            departures.append(departure)
+            arrivals.append(arrival)
+        arrays = Timetable.build_arrays(len(stops), np.concatenate([sources[live], start]), np.concatenate([targets[live], end]),
+                                        np.concatenate([self.conn_lines[live], line_codes]),
+                                        np.concatenate([self.departures[live], np.array(departures, dtype=np.int16)]),
+                                        np.concatenate([self.arrivals[live], np.array(arrivals, dtype=np.int16)]))
+        arrays['latitudes'] = np.array([stop.latitude for stop in stops], dtype=np.float64)
+        arrays['longitudes'] = np.array([stop.longitude for stop in stops], dtype=np.float64)
+        self._set_arrays(stops, lines, arrays)
+        self.dirty_edges = set()
+
+def stop_name(stop: Union[Stop, str]) -> str:
+    return stop if isinstance(stop, str) else stop.name
+
+def update_minutes(time: Union[str, int]) -> int:
+    # "8:05:00" or minutes after midnight
+    return time_to_minutes(time) if isinstance(time, str) else int(time) % day_minutes
+
+def earliest_arrivals(departures: np.ndarray, arrivals: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    # for consecutive runs of the given lengths, sorted by departure: the index of the first arrival from every index
+    # to the end of its run, through midnight counted as the next day and removed connections never
+    n = len(departures)
+    ends = arrivals.astype(np.int64) + np.where(arrivals < departures, day_minutes, 0)
+    ends[departures == tombstone] = 3 * day_minutes
+    # every run above all the runs before it, so the minimum from the back never carries over into a run
+    keys = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths) * 4 * day_minutes + ends
+    suffix = np.minimum.accumulate(keys[::-1])[::-1]
+    # the first index of the run reaching the minimum, the last index of every run reaches its own
+    return np.minimum.accumulate(np.where(keys == suffix, np.arange(n), n)[::-1])[::-1]
+
+def spans(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    # the concatenated ranges starts[i]..ends[i]
+    lengths = ends - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream connection csv files into a timetable and report the ingestion")
+    parser.add_argument('filenames', nargs='+')
+    parser.add_argument('--chunk-size', type=int, default=chunk_rows)
+    args = parser.parse_args()
+    timetable = Timetable.from_csv(args.filenames, args.chunk_size)
+    json.dump(dict(timetable.ingestion, stops=len(timetable.stops), lines=len(timetable.lines), connections=len(timetable.departures)), sys.stdout, indent=2)
@@ -1,9 +1,12 @@
 from dataclasses import dataclass
-import pandas as pd
-from typing import List, Tuple
+import numpy as np
+from typing import List, Tuple, Dict, Set, Callable, Iterator, ContextManager, Union
 import time as tm
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from contextlib import contextmanager, nullcontext
 import sys
+import heapq
+from collections import OrderedDict
 from abc import ABC, abstractmethod
 
 change_minutes = 0
@@ -45,15 +48,155 @@ def time_to_minutes(time_str: str) -> int:
 def format_time(abnormal_time: int) -> str:
     return str(abnormal_time // 60).zfill(2) + ":" + str(abnormal_time % 60).zfill(2)
 
+earth_radius_km = 6371.0088
+
+def haversine_km(latitudes: np.ndarray, longitudes: np.ndarray, latitude: float, longitude: float) -> np.ndarray:
+    # great-circle distances from many points to one, within 0.5% of geodesic
+    lat1, lon1 = np.radians(latitudes), np.radians(longitudes)
+    lat2, lon2 = np.radians(latitude), np.radians(longitude)
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * earth_radius_km * np.arcsin(np.sqrt(a))
+
+class Frontier:
+    # binary heap with lazy deletion - outdated entries are skipped when popped
+    def __init__(self) -> None:
+        self.heap: List[Tuple[float, int, object]] = []
+        self.priorities: Dict[object, float] = {}
+        self.closed: Set[object] = set()
+        self.counter = 0
+
+    def push(self, item: object, priority: float, order: int = None) -> None:
+        # order breaks ties between equal priorities, insertion order by default
+        if order is None:
+            order = self.counter
+            self.counter += 1
+        self.priorities[item] = priority
+        # pushing a closed item again reopens it
+        self.closed.discard(item)
+        heapq.heappush(self.heap, (priority, order, item))
+
+    def pop(self) -> object:
+        while self.heap:
+            priority, _, item = heapq.heappop(self.heap)
+            if item in self.closed or self.priorities[item] != priority:
+                continue
+            self.closed.add(item)
+            return item
+        return None
+
+    def __len__(self) -> int:
+        return len(self.priorities) - len(self.closed)
+
+class Labels:
+    # per-query labels of the nodes 0..size-1, one preallocated list per field, owned by an engine;
+    # a new query only bumps the generation - a node gets its defaults back when first touched in it
+    def __init__(self, size: int, **defaults: object) -> None:
+        self.defaults = list(defaults.items())
+        for name, default in self.defaults:
+            setattr(self, name, [default] * size)
+        self.stamps: List[int] = [0] * size
+        self.generation = 0
+        # nodes touched in the current query, in order of touching
+        self.touched: List[int] = []
+
+    def reset(self) -> None:
+        self.generation += 1
+        self.touched.clear()
+
+    def touch(self, node: int) -> None:
+        if self.stamps[node] != self.generation:
+            self.stamps[node] = self.generation
+            self.touched.append(node)
+            for name, default in self.defaults:
+                getattr(self, name)[node] = default
+
+class LRUCache:
+    # bounded mapping dropping the least recently used entry when full, a size of 0 keeps nothing
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: object) -> object:
+        # None on a miss
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: object, value: object) -> None:
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+@dataclass
+class SearchStats:
+    # counters of the searches, the departure lookups are counted by the timetable
+    queries: int = 0
+    settled: int = 0
+    relaxed: int = 0
+    heuristic_evaluations: int = 0
+    lookups: int = 0
+    # bisection steps of the lookups
+    lookup_steps: int = 0
+    # most entries the frontier heap held at once, stale ones included
+    frontier_peak: int = 0
+    # seconds spent in every phase
+    phases: Dict[str, float] = field(default_factory=dict)
+
+    def frontier(self, size: int) -> None:
+        if size > self.frontier_peak:
+            self.frontier_peak = size
+
+    @contextmanager
+    def phase(self, label: str) -> Iterator[None]:
+        begin = tm.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[label] = self.phases.get(label, 0) + tm.perf_counter() - begin
+
+    def add(self, other: "SearchStats") -> None:
+        for name in ('queries', 'settled', 'relaxed', 'heuristic_evaluations', 'lookups', 'lookup_steps'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.frontier(other.frontier_peak)
+        for label, seconds in other.phases.items():
+            self.phases[label] = self.phases.get(label, 0) + seconds
+
 class Algorithm(ABC):
-    def __init__(self, filename="connection_graph (1).csv") -> None:
+    # whether the index built by _create holds connection times or positions, so any change of the timetable outdates it;
+    # otherwise only added stops, edges and lines do
+    indexes_times = False
+
+    def __init__(self, graph="connection_graph (1).csv") -> None:
+        # graph is a csv filename, a list of them, or a Timetable already loaded and shared with other engines
+        # stats of the running query, None unless somebody profiles or hooks the engine - engines check it before counting
+        self.stats: SearchStats = None
+        self.last_stats: SearchStats = None
+        self.profiles: List[SearchStats] = []
+        self.hooks: List[Callable[["Algorithm", Stop, Stop, str, SearchStats], None]] = []
         self.logs: List[Tuple[str,float]] = [("start", tm.time())]
         self._log("load start")
-        self._load(filename)
+        self._load(graph)
         self._log("load end")
         self._log("graph creation start")
         self._create()
         self._log("graph creation end")
+        # the index is rebuilt before the next query after the timetable changes under it
+        self.stale = False
+        self.graph.subscribe(self._graph_changed)
         
     def _log(self, label: str) -> None:
         self.logs.append((label, tm.time()))
@@ -70,27 +213,80 @@ class Algorithm(ABC):
             if i % 2 == 0 and label == 'proceeding end':
                 return timestamp - self.logs[max(i-1,0)][1]
             
-    def _load(self, filename):
-        self.data = pd.read_csv(filename, low_memory=False)
-        self.data.set_index(keys='Unnamed: 0', inplace=True)
-        self.data.drop_duplicates(ignore_index=True, inplace=True)
+    def _load(self, graph: Union[str, List[str], "Timetable"]):
+        # timetable builds on the helpers of this module, hence the late import
+        from timetable import Timetable
+        self.graph = graph if isinstance(graph, Timetable) else Timetable.load(graph)
     
-    @abstractmethod
     def _create(self):
+        # engines needing their own index on top of the shared graph build it here
         pass
     
+    def _graph_changed(self, structural: bool) -> None:
+        if structural or self.indexes_times:
+            self.stale = True
+
+    def _refresh(self) -> None:
+        if self.stale:
+            self._create()
+            self.stale = False
+
+    @contextmanager
+    def profile(self) -> Iterator[SearchStats]:
+        # stats summed over the queries run inside the block
+        total = SearchStats()
+        self.profiles.append(total)
+        try:
+            yield total
+        finally:
+            self.profiles.remove(total)
+
+    def add_hook(self, hook: Callable[["Algorithm", Stop, Stop, str, SearchStats], None]) -> None:
+        # called after every query with the engine, the query and its stats
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[["Algorithm", Stop, Stop, str, SearchStats], None]) -> None:
+        self.hooks.remove(hook)
+
+    def _phase(self, label: str) -> ContextManager:
+        return self.stats.phase(label) if self.stats is not None else nullcontext()
+    
+    @contextmanager
+    def _query(self, a_start: Stop, b_end: Stop, start_time: str) -> Iterator[SearchStats]:
+        # every search of the engine runs inside it: the index is brought up to date, the stats are counted
+        # and handed to the profiles and hooks once the search is over (b_end is None for all the ends at once)
+        self._refresh()
+        stats = SearchStats(queries=1) if self.profiles or self.hooks else None
+        self.stats = stats
+        self.graph.stats = stats
+        try:
+            yield stats
+        finally:
+            self.stats = None
+            self.graph.stats = None
+        if stats is not None:
+            self.last_stats = stats
+            for total in self.profiles:
+                total.add(stats)
+            for hook in self.hooks:
+                hook(self, a_start, b_end, start_time, stats)
+    
     def run(self, a_start: Stop, b_end: Stop, start_time: str, clear_logs: bool= True, debug: bool=True):
         if clear_logs:
             self.logs = [("start", tm.time())]
-        self._log("proceeding start")
-        self._proceed(a_start, b_end, start_time)
-        self._log("proceeding end")
-        if debug:
-            self._log("printing start")
-            self._print(a_start,b_end,start_time)
-            self._log("printing end")
-            self._print_logs()
-        return self._cost(a_start,b_end,start_time), self._proceeding_time()
+        with self._query(a_start, b_end, start_time):
+            self._log("proceeding start")
+            with self._phase("proceeding"):
+                self._proceed(a_start, b_end, start_time)
+            self._log("proceeding end")
+            if debug:
+                self._log("printing start")
+                with self._phase("printing"):
+                    self._print(a_start,b_end,start_time)
+                self._log("printing end")
+                self._print_logs()
+            cost = self._cost(a_start,b_end,start_time)
+        return cost, self._proceeding_time()
 
     @abstractmethod
     def _proceed(self, a_start: Stop, b_end:Stop, start_time: str) -> None: